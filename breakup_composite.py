@@ -0,0 +1,279 @@
+import os
+import yaml
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import logging
+import datetime
+import warnings
+
+from data_alignment import load_series, input_paths, DATE_COL, ALIGNED_COLUMNS
+
+# Load config
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(CONFIG_PATH, 'r') as file:
+    config = yaml.safe_load(file)
+
+project_folder = config['project_folder'].replace("${base_folder}", config['base_folder']).replace("${gage_number}", config['gage_number']).replace("${site_name}", config['site_name'])
+gage_number = config['gage_number']
+site_name = config['site_name']
+
+# Composite settings
+window = config['breakup_event_window']
+composite_settings = config.get('breakup_composite', {})
+step_minutes = composite_settings.get('step_minutes', 15)
+peak_search_days = composite_settings.get('peak_search_days', 1)
+max_gap = pd.Timedelta(minutes=composite_settings.get('max_gap_minutes', 60))
+percentiles = composite_settings.get('percentiles', [5, 25, 75, 95])
+
+# Output paths
+breakup_events_folder = os.path.join(project_folder, config['folders']['breakup_events'])
+plots_folder = os.path.join(project_folder, config['folders']['plots'])
+composite_file = os.path.join(breakup_events_folder, f"{gage_number}_BreakupComposite.npz")
+composite_plot_file = os.path.join(plots_folder, f"{gage_number}_BreakupComposite.tif")
+
+# Composite variables stored in the events x offsets arrays
+VARIABLES = ['Q/Qp', 'dQ', 'Stage']
+
+
+def series_arrays(series, value_col):
+    """Return sorted int64 times and float values of a series with missing values dropped."""
+    if series is None or series.empty:
+        return np.array([], dtype='int64'), np.array([], dtype=float)
+    valid = series[value_col].notna().to_numpy()
+    times = series[DATE_COL].to_numpy()[valid].astype('datetime64[ns]').astype('int64')
+    values = series[value_col].to_numpy(dtype=float)[valid]
+    return times, values
+
+
+def gather_on_grid(times, values, targets, max_gap_ns):
+    """Linearly interpolate a sorted series at a 2D array of target times in one pass.
+
+    Targets farther than max_gap_ns from a bracketing pair of samples come back as NaN,
+    so gaps and long ice runs are not bridged.
+    """
+    if len(times) == 0:
+        return np.full(targets.shape, np.nan)
+
+    n = len(times)
+    idx = np.searchsorted(times, targets, side='left')
+    hi = np.clip(idx, 0, n - 1)
+    lo = np.clip(idx - 1, 0, n - 1)
+
+    t_lo, t_hi = times[lo], times[hi]
+    span = (t_hi - t_lo).astype(float)
+    exact = t_hi == targets
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(span > 0, (targets - t_lo) / span, 0.0)
+    out = values[lo] + weight * (values[hi] - values[lo])
+    out = np.where(exact, values[hi], out)
+
+    bracketed = (idx > 0) & (idx < n) & (span <= max_gap_ns)
+    out[~(exact | bracketed)] = np.nan
+    return out
+
+
+def build_composite(inst_qw, inst_hw, daily_qw, breakup_dates, days_before=None, days_after=None):
+    """Stack every breakup event onto a common offset-from-peak grid.
+
+    Returns a dict of events x offsets arrays for Q/Qp, dQ and stage, the offsets in hours,
+    and the per-event peak times, peak discharge and pre-breakup discharge.
+    """
+    days_before = window['days_before'] if days_before is None else days_before
+    days_after = window['days_after'] if days_after is None else days_after
+
+    q_col = ALIGNED_COLUMNS['Inst_Qw']
+    d_col = ALIGNED_COLUMNS['Daily_Qw']
+    h_col = ALIGNED_COLUMNS['Inst_Hw']
+    q_times, q_values = series_arrays(inst_qw, q_col)
+    d_times, d_values = series_arrays(daily_qw, d_col)
+    h_times, h_values = series_arrays(inst_hw, h_col)
+
+    step_ns = np.int64(pd.Timedelta(minutes=step_minutes).value)
+    gap_ns = max_gap.value
+    daily_gap_ns = pd.Timedelta(days=1).value + gap_ns
+
+    event_dates = pd.to_datetime(pd.Series(breakup_dates)).dt.normalize().to_numpy().astype('datetime64[ns]')
+    event_ns = event_dates.astype('int64')
+
+    # Peak search window of +/- peak_search_days around each breakup date
+    search_ns = peak_search_days * 86400 * 10 ** 9
+    search_steps = np.arange(-search_ns, search_ns + 1, step_ns)
+
+    # Each event uses inst discharge if inst records reach its search window, daily discharge otherwise,
+    # for both the peak search and the composite window so Q and Qp come from the same series
+    use_inst = (np.searchsorted(q_times, event_ns + search_ns, side='right')
+                > np.searchsorted(q_times, event_ns - search_ns, side='left'))
+
+    def gather_discharge(targets, use_inst):
+        inst = gather_on_grid(q_times, q_values, targets, gap_ns)
+        daily = gather_on_grid(d_times, d_values, targets, daily_gap_ns)
+        return np.where(use_inst[:, None], inst, daily)
+
+    search_q = gather_discharge(event_ns[:, None] + search_steps[None, :], use_inst)
+    has_peak = ~np.all(np.isnan(search_q), axis=1)
+    if not has_peak.all():
+        for missing in event_dates[~has_peak]:
+            logging.warning(f"No discharge found around {pd.Timestamp(missing).date()}. Skipping.")
+    event_dates = event_dates[has_peak]
+    use_inst = use_inst[has_peak]
+    search_q = search_q[has_peak]
+    peak_ns = event_dates.astype('int64') + search_steps[np.nanargmax(search_q, axis=1)]
+    # Qp is the breakup peak itself, not a larger flow that may follow later in the window
+    peak_q = np.nanmax(search_q, axis=1)
+
+    # Offset-from-peak grid
+    offsets = np.arange(-days_before * 86400 * 10 ** 9, days_after * 86400 * 10 ** 9 + 1, step_ns)
+    targets = peak_ns[:, None] + offsets[None, :]
+
+    discharge = gather_discharge(targets, use_inst)
+    stage = gather_on_grid(h_times, h_values, targets, gap_ns)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pre_breakup_q = np.nanmin(discharge, axis=1) if len(discharge) else np.array([])
+        composite = {
+            'Q/Qp': discharge / peak_q[:, None],
+            'dQ': discharge - pre_breakup_q[:, None],
+            'Stage': stage
+        }
+
+    logging.info(f"Built composite of {len(event_dates)} events on {len(offsets)} offsets")
+    return {
+        'offsets_hours': offsets / 3.6e12,
+        'event_dates': event_dates,
+        'peak_times': peak_ns.astype('datetime64[ns]'),
+        'peak_discharge': peak_q,
+        'pre_breakup_discharge': pre_breakup_q,
+        'arrays': composite
+    }
+
+
+def ensemble_stats(composite):
+    """Ensemble mean, median and percentile envelopes across events for each variable."""
+    stats = {}
+    for name in VARIABLES:
+        values = composite['arrays'][name]
+        # All-NaN offset columns (e.g. no stage record) are expected and stay NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            stats[name] = {
+                'Mean': np.nanmean(values, axis=0),
+                'Median': np.nanmedian(values, axis=0),
+                'Count': np.sum(~np.isnan(values), axis=0)
+            }
+            for p, envelope in zip(percentiles, np.nanpercentile(values, percentiles, axis=0)):
+                stats[name][f'P{p}'] = envelope
+    return stats
+
+
+def event_metrics(composite):
+    """Per-event peak metrics computed across the whole events x offsets array at once."""
+    offsets_hours = composite['offsets_hours']
+    discharge_change = composite['arrays']['dQ']
+    stage = composite['arrays']['Stage']
+    step_hours = offsets_hours[1] - offsets_hours[0] if len(offsets_hours) > 1 else 1.0
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        before_peak = offsets_hours <= 0
+        rise_rate = np.nanmax(np.diff(discharge_change[:, before_peak], axis=1), axis=1) / step_hours
+        peak_stage = np.nanmax(stage, axis=1)
+        stage_rise = peak_stage - np.nanmin(stage[:, before_peak], axis=1)
+
+    metrics = pd.DataFrame({
+        'Breakup Date': pd.to_datetime(composite['event_dates']),
+        'Peak Time': pd.to_datetime(composite['peak_times']),
+        'Peak Discharge (cfs)': composite['peak_discharge'],
+        'Pre-Breakup Discharge (cfs)': composite['pre_breakup_discharge'],
+        'Discharge Change (cfs)': composite['peak_discharge'] - composite['pre_breakup_discharge'],
+        'Max Rise Rate (cfs/hr)': rise_rate,
+        'Peak Stage (ft)': peak_stage,
+        'Stage Rise (ft)': stage_rise
+    })
+    return metrics
+
+
+def save_composite(composite, stats, metrics, output_file):
+    """Save arrays, ensemble stats and per-event metrics to one compressed npz file."""
+    payload = {
+        'offsets_hours': composite['offsets_hours'],
+        'event_dates': composite['event_dates'].astype('datetime64[s]').astype(str),
+        'peak_times': composite['peak_times'].astype('datetime64[s]').astype(str),
+        'metrics_columns': np.array(metrics.columns[2:].tolist()),
+        'metrics': metrics.iloc[:, 2:].to_numpy(dtype=float)
+    }
+    for name in VARIABLES:
+        key = name.replace('/', '_')
+        payload[key] = composite['arrays'][name].astype(np.float32)
+        for stat_name, values in stats[name].items():
+            payload[f"{key}_{stat_name}"] = values
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    np.savez_compressed(output_file, **payload)
+    logging.info(f"Saved breakup composite to {output_file}")
+
+
+def plot_composite(composite, stats, output_file):
+    offsets_hours = composite['offsets_hours']
+    labels = {'Q/Qp': 'Dimensionless Discharge (Q/Qp)', 'dQ': 'Discharge Change (cfs)', 'Stage': 'Gage Height (ft)'}
+
+    fig, axes = plt.subplots(len(VARIABLES), 1, figsize=(12, 12), sharex=True)
+    for ax, name in zip(axes, VARIABLES):
+        stat = stats[name]
+        ax.plot(offsets_hours, composite['arrays'][name].T, color='grey', linewidth=0.3, alpha=0.3)
+        if len(percentiles) >= 2:
+            ax.fill_between(offsets_hours, stat[f'P{percentiles[0]}'], stat[f'P{percentiles[-1]}'], color='blue', alpha=0.2,
+                            label=f'P{percentiles[0]}-P{percentiles[-1]}')
+        if len(percentiles) >= 4:
+            ax.fill_between(offsets_hours, stat[f'P{percentiles[1]}'], stat[f'P{percentiles[-2]}'], color='blue', alpha=0.3,
+                            label=f'P{percentiles[1]}-P{percentiles[-2]}')
+        ax.plot(offsets_hours, stat['Mean'], 'k-', label='Mean')
+        ax.plot(offsets_hours, stat['Median'], 'k--', label='Median')
+        ax.axvline(0, color='red', linewidth=1)
+        ax.set_ylabel(labels[name])
+        ax.grid(True)
+        ax.legend(loc='upper left')
+
+    axes[0].set_title(f"{gage_number} {site_name} - Breakup Composite ({len(composite['event_dates'])} events)",
+                      fontsize=14, fontweight='bold')
+    axes[-1].set_xlabel('Hours from Peak Discharge')
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    plt.tight_layout()
+    plt.savefig(output_file, dpi=config['plot_settings']['dpi'], format='tif')
+    plt.close(fig)
+    logging.info(f"Saved breakup composite plot to {output_file}")
+
+
+def run_composite():
+    breakup_dates_file = config['breakup_dates_file'].replace("${project_folder}", project_folder).replace("${folders.breakup_events}", config['folders']['breakup_events'])
+    dates = pd.read_csv(breakup_dates_file, header=None, names=['Date'], comment='#')
+    breakup_dates = pd.to_datetime(dates['Date'], errors='coerce').dropna()
+    if breakup_dates.empty:
+        logging.warning(f"No breakup dates listed in {breakup_dates_file}.")
+        return
+
+    series = {data_type: load_series(path, data_type) if os.path.exists(path) else None
+              for data_type, path in input_paths.items()}
+
+    composite = build_composite(series['Inst_Qw'], series['Inst_Hw'], series['Daily_Qw'], breakup_dates)
+    if len(composite['event_dates']) == 0:
+        logging.warning("No breakup events had discharge data; nothing to composite.")
+        return
+
+    stats = ensemble_stats(composite)
+    metrics = event_metrics(composite)
+
+    save_composite(composite, stats, metrics, composite_file)
+    plot_composite(composite, stats, composite_plot_file)
+
+
+if __name__ == "__main__":
+    log_folder = os.path.join(project_folder, config['folders']['logs'])
+    os.makedirs(log_folder, exist_ok=True)
+    log_file = os.path.join(log_folder, f"breakup_composite_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+    logging.basicConfig(filename=log_file, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    logging.info("Starting breakup composite.")
+    run_composite()
+    print(f"Breakup composite completed. See log for details: {log_file}")
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+# Rough in-memory cost of one parsed CSV row (timestamp, value and pandas overhead)
+BYTES_PER_ROW = 200
+
+# Rough in-memory cost of one downloaded USGS JSON record (response text plus parsed dicts)
+JSON_BYTES_PER_ROW = 1000
+
+# Sketch bucket keys: 0 holds zeros, positives sit above SKETCH_OFFSET and negatives mirror below -SKETCH_OFFSET
+SKETCH_OFFSET = 10 ** 6
+SKETCH_ZERO = 1e-9
+
+STAT_COLUMNS = ['Min', 'Max', 'Mean', 'Median', 'P5', 'P25', 'P75', 'P95']
+
+
+def chunk_rows_for_budget(memory_budget_mb, bytes_per_row=BYTES_PER_ROW):
+    """Rows per chunk that keep one parsed chunk inside the memory budget."""
+    return max(int(memory_budget_mb * 1024 * 1024 / bytes_per_row), 1000)
+
+
+def iter_csv_chunks(file_path, chunk_rows, **read_csv_kwargs):
+    """Stream a processed CSV (with its '#' header block) in chunks of chunk_rows rows."""
+    with open(file_path, 'r') as file:
+        header_index = 0
+        for i, line in enumerate(file):
+            if not line.startswith("#"):
+                header_index = i
+                break
+
+    return pd.read_csv(file_path, skiprows=header_index, chunksize=chunk_rows, **read_csv_kwargs)
+
+
+def sketch_gamma(relative_accuracy):
+    return (1 + relative_accuracy) / (1 - relative_accuracy)
+
+
+def sketch_keys(values, relative_accuracy):
+    """Log-spaced bucket key of each value; every value in a bucket is within relative_accuracy of its representative."""
+    log_gamma = np.log(sketch_gamma(relative_accuracy))
+    magnitude = np.abs(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = np.ceil(np.log(np.maximum(magnitude, SKETCH_ZERO)) / log_gamma).astype(np.int64) + SKETCH_OFFSET
+    return np.where(magnitude < SKETCH_ZERO, 0, np.where(values > 0, index, -index))
+
+
+def sketch_values(keys, relative_accuracy):
+    """Representative value of each bucket key."""
+    gamma = sketch_gamma(relative_accuracy)
+    keys = np.asarray(keys, dtype=np.int64)
+    magnitude = 2 * gamma ** (np.abs(keys) - SKETCH_OFFSET).astype(float) / (gamma + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * magnitude)
+
+
+def new_accumulator():
+    """Empty chunk-mergeable accumulator of count, sum, extrema and a quantile sketch per group key."""
+    return {'moments': None, 'sketch': None}
+
+
+def update_accumulator(acc, keys, values, relative_accuracy):
+    """Fold one chunk of (group key, value) pairs into the accumulator."""
+    keys = pd.Series(np.asarray(keys))
+    values = pd.Series(np.asarray(values, dtype=float))
+    valid = values.notna().to_numpy()
+    keys, values = keys[valid], values[valid]
+    if values.empty:
+        return acc
+
+    moments = values.groupby(keys.to_numpy()).agg(['count', 'sum', 'min', 'max'])
+    moments.columns = ['Count', 'Sum', 'Min', 'Max']
+    sketch = values.groupby([keys.to_numpy(), sketch_keys(values.to_numpy(), relative_accuracy)]).size()
+
+    return merge_accumulators(acc, {'moments': moments, 'sketch': sketch})
+
+
+def merge_accumulators(left, right):
+    """Combine two accumulators, e.g. consecutive chunks or different gages."""
+    if left['moments'] is None:
+        return right
+    if right['moments'] is None:
+        return left
+
+    combined = pd.concat([left['moments'], right['moments']])
+    moments = combined.groupby(level=0).agg({'Count': 'sum', 'Sum': 'sum', 'Min': 'min', 'Max': 'max'})
+    sketch = left['sketch'].add(right['sketch'], fill_value=0)
+    return {'moments': moments, 'sketch': sketch}
+
+
+def sketch_quantiles(sketch, counts, quantiles, relative_accuracy):
+    """Per-group quantiles from a (group, bucket) count sketch, using the rank convention of pandas quantile."""
+    sketch = sketch.sort_index()
+    groups = sketch.index.get_level_values(0)
+    cumulative = sketch.groupby(level=0).cumsum().to_numpy()
+    n = counts.reindex(groups).to_numpy()
+
+    def value_at_rank(rank):
+        reached = pd.Series(cumulative > rank, index=sketch.index)
+        first = reached[reached.to_numpy()].groupby(level=0).head(1)
+        return pd.Series(sketch_values(first.index.get_level_values(1), relative_accuracy),
+                         index=first.index.get_level_values(0))
+
+    results = {}
+    for q in quantiles:
+        # Linear interpolation between the samples at the ranks around q*(n-1), as pandas quantile does
+        position = q * (n - 1)
+        lower = value_at_rank(np.floor(position))
+        upper = value_at_rank(np.ceil(position))
+        fraction = pd.Series(position - np.floor(position), index=groups).groupby(level=0).first()
+        results[q] = lower + fraction.reindex(lower.index) * (upper - lower)
+    return results
+
+
+def finalize_stats(acc, relative_accuracy):
+    """Min/Max/Mean/Median/P5/P25/P75/P95 per group, matching the in-memory stats frames.
+
+    Count, Min, Max and Mean are exact; Median and percentiles are within relative_accuracy
+    of the in-memory pandas quantiles.
+    """
+    if acc['moments'] is None:
+        return pd.DataFrame(columns=STAT_COLUMNS)
+
+    moments = acc['moments']
+    quantiles = sketch_quantiles(acc['sketch'], moments['Count'], [0.5, 0.05, 0.25, 0.75, 0.95], relative_accuracy)
+
+    stats = pd.DataFrame({
+        'Min': moments['Min'],
+        'Max': moments['Max'],
+        'Mean': moments['Sum'] / moments['Count'],
+        'Median': quantiles[0.5],
+        'P5': quantiles[0.05],
+        'P25': quantiles[0.25],
+        'P75': quantiles[0.75],
+        'P95': quantiles[0.95]
+    })
+
+    # Bucket representatives can step just outside the exact extrema
+    for col in ['Median', 'P5', 'P25', 'P75', 'P95']:
+        stats[col] = stats[col].clip(lower=stats['Min'], upper=stats['Max'])
+    return stats[STAT_COLUMNS]
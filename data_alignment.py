@@ -0,0 +1,193 @@
+import os
+import yaml
+import numpy as np
+import pandas as pd
+import logging
+import datetime
+
+# Load config
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(CONFIG_PATH, 'r') as file:
+    config = yaml.safe_load(file)
+
+project_folder = config['project_folder'].replace("${base_folder}", config['base_folder']).replace("${gage_number}", config['gage_number']).replace("${site_name}", config['site_name'])
+gage_number = config['gage_number']
+
+# Alignment tolerances
+alignment_settings = config.get('alignment', {})
+inst_tolerance = pd.Timedelta(minutes=alignment_settings.get('inst_tolerance_minutes', 30))
+daily_tolerance = pd.Timedelta(hours=alignment_settings.get('daily_tolerance_hours', 12))
+
+# Input paths
+input_paths = {
+    'Daily_Qw': os.path.join(project_folder, config['folders']['daily_qw'], f'{gage_number}_Daily_Qw.csv'),
+    'Inst_Qw': os.path.join(project_folder, config['folders']['inst_qw'], f'{gage_number}_Inst_Qw.csv'),
+    'Inst_Hw': os.path.join(project_folder, config['folders']['inst_hw'], f'{gage_number}_Inst_Hw.csv')
+}
+value_columns = {
+    'Daily_Qw': 'Discharge (cfs)',
+    'Inst_Qw': 'Discharge (cfs)',
+    'Inst_Hw': 'Gage Height (ft)'
+}
+
+# Output folders
+aligned_folder = os.path.join(project_folder, config['folders']['processed_data'], 'Aligned')
+breakup_events_folder = os.path.join(project_folder, config['folders']['breakup_events'])
+
+# Combined frame columns
+DATE_COL = 'Date & Time'
+ALIGNED_COLUMNS = {
+    'Inst_Qw': 'Inst Discharge (cfs)',
+    'Inst_Hw': 'Inst Gage Height (ft)',
+    'Daily_Qw': 'Daily Discharge (cfs)'
+}
+
+
+def load_series(file_path, data_type):
+    """Load a processed series as a sorted frame of time, numeric value and ice flag."""
+    with open(file_path, 'r') as file:
+        header_index = 0
+        for i, line in enumerate(file):
+            if not line.startswith("#"):
+                header_index = i
+                break
+
+    value_col = value_columns[data_type]
+    df = pd.read_csv(file_path, skiprows=header_index, usecols=[DATE_COL, value_col], dtype={value_col: 'str'})
+
+    raw_values = df[value_col].str.strip()
+    series = pd.DataFrame({
+        DATE_COL: pd.to_datetime(df[DATE_COL], errors='coerce'),
+        ALIGNED_COLUMNS[data_type]: pd.to_numeric(raw_values, errors='coerce'),
+        f"{data_type} Ice": raw_values.eq('Ice')
+    })
+    series = series.dropna(subset=[DATE_COL]).sort_values(DATE_COL, kind='mergesort')
+    series = series.drop_duplicates(subset=DATE_COL, keep='last').reset_index(drop=True)
+
+    logging.info(f"Loaded {data_type} from {file_path} with {len(series)} records")
+    return series
+
+
+def align_series(inst_qw, inst_hw, daily_qw, inst_tol=inst_tolerance, daily_tol=daily_tolerance):
+    """Join inst Q, inst H and noon-stamped daily Q onto one time axis with as-of merges."""
+    inst_frames = [s for s in (inst_qw, inst_hw) if s is not None and not s.empty]
+    if inst_frames:
+        axis = inst_frames[0][DATE_COL].to_numpy()
+        for frame in inst_frames[1:]:
+            axis = np.union1d(axis, frame[DATE_COL].to_numpy())
+    elif daily_qw is not None and not daily_qw.empty:
+        axis = daily_qw[DATE_COL].to_numpy()
+    else:
+        return pd.DataFrame(columns=[DATE_COL])
+
+    combined = pd.DataFrame({DATE_COL: axis})
+
+    # One vectorized as-of merge per inst series
+    for data_type, series in (('Inst_Qw', inst_qw), ('Inst_Hw', inst_hw)):
+        if series is None or series.empty:
+            continue
+        combined = pd.merge_asof(combined, series, on=DATE_COL, direction='nearest', tolerance=inst_tol)
+
+    # Daily values are stamped at noon, so key each row on its own day's noon
+    if daily_qw is not None and not daily_qw.empty:
+        combined['Daily Key'] = combined[DATE_COL].dt.floor('D') + pd.Timedelta(hours=12)
+        daily = daily_qw.rename(columns={DATE_COL: 'Daily Key'})
+        combined = pd.merge_asof(combined, daily, on='Daily Key', direction='nearest', tolerance=daily_tol)
+        combined = combined.drop(columns='Daily Key')
+
+    for col in [c for c in combined.columns if c.endswith(' Ice')]:
+        combined[col] = combined[col].astype('boolean').fillna(False).astype(bool)
+
+    logging.info(f"Aligned {len(combined)} timestamps with columns {combined.columns.tolist()}")
+    return combined
+
+
+def slice_window(combined, start, end):
+    """Return the rows of a sorted combined frame between start and end (inclusive)."""
+    times = combined[DATE_COL].to_numpy()
+    lo = np.searchsorted(times, np.datetime64(pd.Timestamp(start)), side='left')
+    hi = np.searchsorted(times, np.datetime64(pd.Timestamp(end)), side='right')
+    return combined.iloc[lo:hi].reset_index(drop=True)
+
+
+def align_events(combined, breakup_dates, days_before=None, days_after=None):
+    """Split the combined frame into windows around each breakup date."""
+    window = config['breakup_event_window']
+    days_before = window['days_before'] if days_before is None else days_before
+    days_after = window['days_after'] if days_after is None else days_after
+
+    events = {}
+    for breakup_date in pd.to_datetime(pd.Series(breakup_dates)).dt.normalize():
+        event = slice_window(combined,
+                             breakup_date - pd.Timedelta(days=days_before),
+                             breakup_date + pd.Timedelta(days=days_after + 1) - pd.Timedelta(seconds=1))
+        if event.empty:
+            logging.warning(f"No aligned data found around {breakup_date.date()}. Skipping.")
+            continue
+        events[breakup_date] = event
+    return events
+
+
+def align_winters(combined):
+    """Split the combined frame into winter seasons defined in config."""
+    if combined.empty:
+        return {}
+
+    start_md = config['winter_season']['start']
+    end_md = config['winter_season']['end']
+    first_year = combined[DATE_COL].iloc[0].year - 1
+    last_year = combined[DATE_COL].iloc[-1].year
+
+    winters = {}
+    for water_year in range(first_year, last_year + 1):
+        season = slice_window(combined,
+                              pd.Timestamp(f"{water_year}-{start_md}"),
+                              pd.Timestamp(f"{water_year + 1}-{end_md}") + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))
+        if not season.empty:
+            winters[f"{water_year}-{water_year + 1}"] = season
+    return winters
+
+
+def load_combined():
+    series = {}
+    for data_type, file_path in input_paths.items():
+        if os.path.exists(file_path):
+            series[data_type] = load_series(file_path, data_type)
+        else:
+            logging.warning(f"Missing file for {data_type}, aligning without it.")
+            series[data_type] = None
+
+    return align_series(series['Inst_Qw'], series['Inst_Hw'], series['Daily_Qw'])
+
+
+def run_alignment():
+    combined = load_combined()
+    if combined.empty:
+        logging.warning("No data available to align.")
+        return
+
+    os.makedirs(aligned_folder, exist_ok=True)
+    for winter, season in align_winters(combined).items():
+        output_file = os.path.join(aligned_folder, f"{gage_number}_WinterAligned_{winter}.csv")
+        season.to_csv(output_file, index=False)
+        logging.info(f"Saved aligned winter data for {winter} to {output_file}")
+
+    breakup_dates_file = config['breakup_dates_file'].replace("${project_folder}", project_folder).replace("${folders.breakup_events}", config['folders']['breakup_events'])
+    if os.path.exists(breakup_dates_file):
+        dates = pd.read_csv(breakup_dates_file, header=None, names=['Date'], comment='#')
+        breakup_dates = pd.to_datetime(dates['Date'], errors='coerce').dropna()
+        for breakup_date, event in align_events(combined, breakup_dates).items():
+            output_file = os.path.join(breakup_events_folder, f"BreakUp_Event_{breakup_date.strftime('%Y-%m-%d')}_Aligned.csv")
+            event.to_csv(output_file, index=False)
+            logging.info(f"Saved aligned breakup event data to {output_file}")
+
+
+if __name__ == "__main__":
+    log_folder = os.path.join(project_folder, config['folders']['logs'])
+    os.makedirs(log_folder, exist_ok=True)
+    log_file = os.path.join(log_folder, f"data_alignment_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+    logging.basicConfig(filename=log_file, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    logging.info("Starting data alignment.")
+    run_alignment()
+    print(f"Data alignment completed. See log for details: {log_file}")
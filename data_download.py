@@ -6,6 +6,9 @@ import logging
 import datetime
 import json
 
+from data_quality import build_quality_table_from_frame, new_quality_scan, update_quality_scan, finish_quality_scan, gap_list, interval_changes, median_interval, ice_summary, DEFAULT_GAP_THRESHOLD
+from chunked_processing import chunk_rows_for_budget, JSON_BYTES_PER_ROW
+
 # Load config
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
 with open(CONFIG_PATH, 'r') as file:
@@ -21,6 +24,12 @@ os.makedirs(log_folder, exist_ok=True)
 log_file = os.path.join(log_folder, f"data_downloader_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
 logging.basicConfig(filename=log_file, level=getattr(logging, config['logging']['level']), format=config['logging']['format'])
 
+out_of_core = config.get('out_of_core', {})
+slice_records = chunk_rows_for_budget(out_of_core.get('memory_budget_mb', 256), bytes_per_row=JSON_BYTES_PER_ROW)
+
+# Records per day used to size download slices; iv assumes the finest (5-minute) sampling
+RECORDS_PER_DAY = {'dv': 1, 'iv': 288}
+
 def get_folder_path(key):
     return os.path.join(project_folder, config['folders'][key])
 
@@ -35,12 +44,12 @@ def download_data(site, param, service, start, end):
     response.raise_for_status()
     return response.json()
 
-def process_data(raw_data, service, param):
-    records = []
+def iter_raw_records(raw_data):
     for series in raw_data['value']['timeSeries']:
         for value in series['values'][0]['value']:
-            records.append({'dateTime': value['dateTime'], 'value': value['value']})
+            yield {'dateTime': value['dateTime'], 'value': value['value']}
 
+def records_to_frame(records, service, param):
     df = pd.DataFrame(records)
     col = 'Discharge (cfs)' if param == '00060' else 'Gage Height (ft)'
     df['Date & Time'] = pd.to_datetime(df['dateTime'], utc=True).dt.tz_convert(None)
@@ -55,40 +64,38 @@ def process_data(raw_data, service, param):
 
     return df
 
-def analyze_data_with_intervals(df, data_type):
-    df['gap'] = df['Date & Time'].diff().dt.total_seconds() / 60
-    median_interval = df['gap'][df['gap'] <= 120].median()
-    sampling_interval = 1440 if data_type == 'daily' else median_interval
-
+def process_data(raw_data, service, param):
+    return records_to_frame(list(iter_raw_records(raw_data)), service, param)
+
+def time_slices(start, end, days_per_slice):
+    """Consecutive inclusive date ranges of at most days_per_slice days covering start to end."""
+    slice_start = pd.Timestamp(start)
+    last = pd.Timestamp(end)
+    while slice_start <= last:
+        slice_end = min(slice_start + pd.Timedelta(days=days_per_slice - 1), last)
+        yield slice_start.strftime('%Y-%m-%d'), slice_end.strftime('%Y-%m-%d')
+        slice_start = slice_end + pd.Timedelta(days=1)
+
+def analyze_data_with_intervals(data_type, runs):
+    median_interval_minutes = median_interval(runs, max_interval_minutes=120)
+    sampling_interval = 1440 if data_type == 'daily' else median_interval_minutes
+
+    first, last = runs['Start'].min(), runs['End'].max()
     if data_type == 'daily':
-        expected_periods = (df['Date & Time'].max() - df['Date & Time'].min()).days + 1
+        expected_periods = (last - first).days + 1
     else:
-        expected_periods = ((df['Date & Time'].max() - df['Date & Time'].min()).total_seconds() / (sampling_interval * 60)) + 1
+        expected_periods = ((last - first).total_seconds() / (sampling_interval * 60)) + 1
 
-    completeness = 100 * len(df) / expected_periods
+    completeness = 100 * runs['Count'].sum() / expected_periods
 
     gaps = []
-    interval_changes = []
+    changes = []
 
     if data_type == 'inst':
-        previous_interval = df['gap'].iloc[1] if len(df) > 1 else sampling_interval
-        for i in range(2, len(df)):
-            current_interval = df['gap'].iloc[i]
+        gaps = gap_list(runs)
+        changes = interval_changes(runs)
 
-            if current_interval > 120:
-                gaps.append(f"{df['Date & Time'].iloc[i-1]} to {df['Date & Time'].iloc[i]}")
-                continue
-
-            if current_interval != previous_interval:
-                interval_changes.append({
-                    "start": df['Date & Time'].iloc[i-1],
-                    "end": df['Date & Time'].iloc[i],
-                    "interval_minutes": current_interval
-                })
-
-            previous_interval = current_interval
-
-    return completeness, gaps, sampling_interval, interval_changes
+    return completeness, gaps, sampling_interval, changes
 
 def save_metadata(metadata_path, gage, param, service, start, end, completeness, gaps, interval, interval_changes):
     metadata = {
@@ -106,11 +113,11 @@ def save_metadata(metadata_path, gage, param, service, start, end, completeness,
     with open(metadata_path, 'w') as f:
         json.dump(metadata, f, indent=4, default=str)
 
-def save_summary(df, summary_path):
-    start = df['Date & Time'].min().strftime('%Y-%m-%d %H:%M')
-    end = df['Date & Time'].max().strftime('%Y-%m-%d %H:%M')
-    total_records = len(df)
-    ice_records = (df['Discharge (cfs)'] == 'Ice').sum() if 'Discharge (cfs)' in df.columns else 0
+def save_summary(summary_path, runs):
+    start = runs['Start'].min().strftime('%Y-%m-%d %H:%M')
+    end = runs['End'].max().strftime('%Y-%m-%d %H:%M')
+    total_records = int(runs['Count'].sum())
+    ice_records = ice_summary(runs)['Ice Records']
 
     summary = {
         "Start Date": start,
@@ -122,17 +129,55 @@ def save_summary(df, summary_path):
     with open(summary_path, 'w') as f:
         json.dump(summary, f, indent=4)
 
-def save_data(df, save_path):
+def file_header():
     header = [
         f"# Gage: {gage_number}",
         f"# Downloaded: {datetime.datetime.now().isoformat()}",
         f"# Processed with Ice-Breakup-Toolkit v1.0",
         ""
     ]
+    return '\n'.join(header)
+
+def save_data(df, save_path):
     with open(save_path, 'w') as f:
-        f.write('\n'.join(header))
+        f.write(file_header())
         df.to_csv(f, index=False)
 
+def download_data_sliced(param, service, start, end, raw_path, save_path, value_col, gap_threshold):
+    """Request the record in time slices sized to the memory budget, writing each slice as it arrives.
+
+    Each slice gets its own raw JSON file and is folded into the run-length scan, so no
+    full-length response, frame or array is ever held.
+    """
+    days_per_slice = max(slice_records // RECORDS_PER_DAY[service], 1)
+    scan = new_quality_scan()
+    wrote_columns = False
+
+    with open(save_path, 'w') as f:
+        f.write(file_header())
+        for slice_start, slice_end in time_slices(start, end, days_per_slice):
+            raw_data = download_data(gage_number, param, service, slice_start, slice_end)
+            with open(raw_path.replace('_raw.json', f'_raw_{slice_start}_{slice_end}.json'), 'w') as raw_file:
+                json.dump(raw_data, raw_file, indent=4)
+
+            records = list(iter_raw_records(raw_data))
+            del raw_data
+            if not records:
+                logging.info(f"No records between {slice_start} and {slice_end}")
+                continue
+
+            df = records_to_frame(records, service, param)
+            df.to_csv(f, index=False, header=not wrote_columns)
+            wrote_columns = True
+
+            df = df.sort_values('Date & Time', kind='mergesort')
+            scan = update_quality_scan(scan, df['Date & Time'].to_numpy(),
+                                       pd.to_numeric(df[value_col], errors='coerce').to_numpy(dtype=float),
+                                       df[value_col].eq('Ice').to_numpy(), gap_threshold)
+            logging.info(f"Saved {len(df)} records between {slice_start} and {slice_end}")
+
+    return finish_quality_scan(scan, gap_threshold)
+
 def run_downloads():
     datasets = [
         ('00060', 'dv', 'daily_qw', f'{gage_number}_Daily_Qw.csv', available_dates['daily_streamflow'], 'daily'),
@@ -149,16 +194,28 @@ def run_downloads():
         metadata_path = os.path.join(folder, file_name.replace('.csv', '_metadata.json'))
         summary_path = os.path.join(folder, file_name.replace('.csv', '_summary.json'))
 
-        raw_data = download_data(gage_number, param, service, start, end)
-        with open(raw_path, 'w') as f:
-            json.dump(raw_data, f, indent=4)
+        # One run-length scan of the series answers completeness, gaps, interval changes and ice counts
+        value_col = 'Discharge (cfs)' if param == '00060' else 'Gage Height (ft)'
+        gap_threshold = pd.Timedelta(days=1) if data_type == 'daily' else DEFAULT_GAP_THRESHOLD
+
+        if out_of_core.get('enabled', False):
+            runs = download_data_sliced(param, service, start, end, raw_path, processed_path, value_col, gap_threshold)
+        else:
+            raw_data = download_data(gage_number, param, service, start, end)
+            with open(raw_path, 'w') as f:
+                json.dump(raw_data, f, indent=4)
+
+            df = process_data(raw_data, service, param)
+            runs = build_quality_table_from_frame(df, 'Date & Time', value_col, gap_threshold=gap_threshold)
+            save_data(df, processed_path)
 
-        df = process_data(raw_data, service, param)
-        completeness, gaps, interval, interval_changes = analyze_data_with_intervals(df, data_type)
+        if runs.empty:
+            logging.warning(f"No records downloaded for {file_name}, skipping metadata.")
+            continue
 
-        save_data(df, processed_path)
-        save_metadata(metadata_path, gage_number, param, service, start, end, completeness, gaps, interval, interval_changes)
-        save_summary(df, summary_path)
+        completeness, gaps, interval, changes = analyze_data_with_intervals(data_type, runs)
+        save_metadata(metadata_path, gage_number, param, service, start, end, completeness, gaps, interval, changes)
+        save_summary(summary_path, runs)
 
 if __name__ == "__main__":
     run_downloads()
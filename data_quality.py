@@ -0,0 +1,260 @@
+import numpy as np
+import pandas as pd
+
+# Run states; 'Gap' runs hold no samples and span a time hole wider than the gap threshold
+STATES = ['Valid', 'Ice', 'Missing']
+RUN_COLUMNS = ['State', 'Start', 'End', 'Count', 'Interval (min)']
+
+DEFAULT_GAP_THRESHOLD = pd.Timedelta(minutes=120)
+
+
+def build_quality_table(times, values, ice=None, gap_threshold=DEFAULT_GAP_THRESHOLD):
+    """Turn a sorted series into a run-length table of Valid, Ice, Missing and Gap runs.
+
+    Every sample run is evenly spaced (a new run starts whenever the state or the sampling
+    interval changes), so any window can be answered from Start, Count and Interval alone.
+    """
+    times = np.asarray(times, dtype='datetime64[ns]').astype('int64')
+    values = np.asarray(values, dtype=float)
+    n = len(times)
+    if n == 0:
+        return pd.DataFrame(columns=RUN_COLUMNS)
+
+    ice = np.zeros(n, dtype=bool) if ice is None else np.asarray(ice, dtype=bool)
+    state = np.where(ice, 1, np.where(np.isnan(values), 2, 0))
+
+    diff = np.diff(times)
+    is_gap = diff > pd.Timedelta(gap_threshold).value
+    step_change = np.r_[False, (diff[1:] != diff[:-1]) & ~is_gap[:-1]] if n > 1 else np.array([], dtype=bool)
+    boundary = (state[1:] != state[:-1]) | is_gap | step_change
+
+    starts = np.r_[0, np.flatnonzero(boundary) + 1]
+    ends = np.r_[starts[1:], n] - 1
+    counts = ends - starts + 1
+
+    # Single-sample runs take the interval of the neighbouring step that is not a gap
+    step = np.r_[diff, np.nan].astype(float)
+    step[np.r_[is_gap, False]] = np.nan
+    incoming = np.r_[np.nan, step[:-1]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        interval = np.where(counts > 1, (times[ends] - times[starts]) / np.maximum(counts - 1, 1),
+                            np.where(np.isnan(incoming[starts]), step[starts], incoming[starts]))
+
+    sample_runs = pd.DataFrame({
+        'State': np.array(STATES)[state[starts]],
+        'Start': times[starts],
+        'End': times[ends],
+        'Count': counts,
+        'Interval (min)': interval / 6e10
+    })
+
+    gap_at = np.flatnonzero(is_gap)
+    gap_runs = pd.DataFrame({
+        'State': 'Gap',
+        'Start': times[gap_at],
+        'End': times[gap_at + 1],
+        'Count': 0,
+        'Interval (min)': np.nan
+    })
+
+    runs = pd.concat([sample_runs, gap_runs], ignore_index=True)
+    order = np.lexsort(((runs['State'] == 'Gap').to_numpy(), runs['End'].to_numpy(), runs['Start'].to_numpy()))
+    runs = runs.iloc[order].reset_index(drop=True)
+    runs['Start'] = runs['Start'].astype('datetime64[ns]')
+    runs['End'] = runs['End'].astype('datetime64[ns]')
+    return runs
+
+
+def build_quality_table_from_frame(df, date_col, value_col, gap_threshold=DEFAULT_GAP_THRESHOLD):
+    """Run-length table of a frame whose value column may hold 'Ice' strings."""
+    df = df.sort_values(date_col, kind='mergesort')
+    raw_values = df[value_col]
+    ice = raw_values.astype(str).str.strip().eq('Ice').to_numpy()
+    values = pd.to_numeric(raw_values, errors='coerce').to_numpy(dtype=float)
+    return build_quality_table(df[date_col].to_numpy(), values, ice, gap_threshold)
+
+
+def new_quality_scan():
+    """Empty scan for building a run-length table slice by slice."""
+    return {'runs': [], 'tail': None, 'tail_start': None}
+
+
+def update_quality_scan(scan, times, values, ice=None, gap_threshold=DEFAULT_GAP_THRESHOLD):
+    """Fold the next time-ordered slice of a series into the scan.
+
+    The last run of each slice stays open, with the two samples before it kept as context,
+    so runs spanning slice edges come out exactly as a single build_quality_table call would.
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    values = np.asarray(values, dtype=float)
+    ice = np.zeros(len(times), dtype=bool) if ice is None else np.asarray(ice, dtype=bool)
+    if scan['tail'] is not None:
+        newer = times > scan['tail'][0][-1]
+        times, values, ice = (np.concatenate([old, new[newer]]) for old, new in zip(scan['tail'], (times, values, ice)))
+    if len(times) == 0:
+        return scan
+
+    runs = build_quality_table(times, values, ice, gap_threshold)
+    if scan['tail_start'] is not None:
+        # Runs of the context samples were already committed by the previous slice
+        runs = runs[runs['Start'] >= scan['tail_start']].reset_index(drop=True)
+
+    last_start = runs['Start'].iloc[-1].to_datetime64()
+    first = np.searchsorted(times, last_start)
+    keep_from = max(first - 2, 0)
+
+    scan['runs'].append(runs.iloc[:-1])
+    scan['tail'] = (times[keep_from:], values[keep_from:], ice[keep_from:])
+    scan['tail_start'] = last_start
+    return scan
+
+
+def finish_quality_scan(scan, gap_threshold=DEFAULT_GAP_THRESHOLD):
+    """Run-length table of everything folded into the scan."""
+    if scan['tail'] is None:
+        return pd.DataFrame(columns=RUN_COLUMNS)
+
+    last = build_quality_table(*scan['tail'], gap_threshold=gap_threshold)
+    last = last[last['Start'] >= scan['tail_start']]
+    return pd.concat(scan['runs'] + [last], ignore_index=True)
+
+
+def count_samples(runs, start=None, end=None, states=('Valid',), grid_step=None):
+    """Number of samples in the given states between start and end (inclusive).
+
+    With grid_step, only samples falling on the regular grid anchored at start are
+    counted, which is what reindexing onto that grid would keep.
+    """
+    selected = runs[runs['State'].isin(states)]
+    if selected.empty:
+        return 0
+
+    s = selected['Start'].to_numpy().astype('int64')
+    c = selected['Count'].to_numpy().astype('int64')
+    iv = np.round(np.nan_to_num(selected['Interval (min)'].to_numpy(dtype=float)) * 6e10).astype('int64')
+    a = s.min() if start is None else pd.Timestamp(start).value
+    b = (s + (c - 1) * iv).max() if end is None else pd.Timestamp(end).value
+
+    single = (c == 1) | (iv <= 0)
+    iv_safe = np.where(single, 1, iv)
+    k_lo = np.where(single, np.where(s >= a, 0, 1), np.maximum(-((s - a) // iv_safe), 0))
+    k_hi = np.where(single, np.where(s <= b, 0, -1), np.minimum((b - s) // iv_safe, c - 1))
+
+    if grid_step is None:
+        return int(np.maximum(k_hi - k_lo + 1, 0).sum())
+
+    # Samples s + k*iv on the grid a + j*G satisfy k*iv = (a - s) mod G, a progression in k
+    G = pd.Timedelta(grid_step).value
+    offset = (a - s) % G
+    g = np.gcd(iv_safe, G)
+    solvable = np.where(single, offset == 0, offset % g == 0)
+    period = G // g
+    k0 = np.zeros(len(s), dtype='int64')
+    for step_ns in np.unique(iv_safe[~single & solvable]):
+        rows = ~single & solvable & (iv_safe == step_ns)
+        gg = int(np.gcd(step_ns, G))
+        modulus = G // gg
+        inverse = pow(int(step_ns // gg) % modulus, -1, modulus) if modulus > 1 else 0
+        k0[rows] = (offset[rows] // gg * inverse) % modulus
+    first = k_lo + (k0 - k_lo) % period
+    on_grid = np.where(single, (k_hi >= k_lo).astype('int64'), np.where(first <= k_hi, (k_hi - first) // period + 1, 0))
+    return int(np.where(solvable, on_grid, 0).sum())
+
+
+def completeness(runs, start, end, interval_minutes, states=('Valid',)):
+    """Percent of the regular grid between start and end that holds a sample, without building the grid."""
+    step = pd.Timedelta(minutes=interval_minutes)
+    expected = int((pd.Timestamp(end) - pd.Timestamp(start)) // step) + 1
+    if expected <= 0:
+        return 0.0
+    return 100 * count_samples(runs, start, end, states, grid_step=step) / expected
+
+
+def gap_list(runs, start=None, end=None):
+    """Gap runs overlapping the window, as 'start to end' strings."""
+    gaps = runs[runs['State'] == 'Gap']
+    if start is not None:
+        gaps = gaps[gaps['End'] >= pd.Timestamp(start)]
+    if end is not None:
+        gaps = gaps[gaps['Start'] <= pd.Timestamp(end)]
+    return [f"{s} to {e}" for s, e in zip(gaps['Start'], gaps['End'])]
+
+
+def break_times(runs):
+    """Times of the first sample after each gap and of each Ice/Missing run, where plot lines should break."""
+    after_gap = runs.loc[runs['State'] == 'Gap', 'End']
+    no_value = runs.loc[runs['State'].isin(['Ice', 'Missing']), 'Start']
+    return np.unique(np.concatenate([after_gap.to_numpy(), no_value.to_numpy()]))
+
+
+def ice_summary(runs, start=None, end=None):
+    """Ice record count, first/last ice time and ice-season duration for a window."""
+    ice = runs[runs['State'] == 'Ice']
+    if start is not None:
+        ice = ice[ice['End'] >= pd.Timestamp(start)]
+    if end is not None:
+        ice = ice[ice['Start'] <= pd.Timestamp(end)]
+
+    ice_records = count_samples(ice, start, end, states=('Ice',))
+    if ice.empty:
+        return {'Ice Records': 0, 'First Ice': None, 'Last Ice': None, 'Ice Season (days)': 0.0}
+
+    first = max(ice['Start'].min(), pd.Timestamp(start)) if start is not None else ice['Start'].min()
+    last = min(ice['End'].max(), pd.Timestamp(end)) if end is not None else ice['End'].max()
+    return {
+        'Ice Records': ice_records,
+        'First Ice': first,
+        'Last Ice': last,
+        'Ice Season (days)': round((last - first) / pd.Timedelta(days=1), 2)
+    }
+
+
+def median_interval(runs, max_interval_minutes=120):
+    """Sample-weighted median sampling interval over the sample runs."""
+    sample_runs = runs[(runs['State'] != 'Gap') & (runs['Count'] > 1)]
+    sample_runs = sample_runs[sample_runs['Interval (min)'] <= max_interval_minutes]
+    if sample_runs.empty:
+        return np.nan
+
+    order = np.argsort(sample_runs['Interval (min)'].to_numpy())
+    intervals = sample_runs['Interval (min)'].to_numpy()[order]
+    weights = (sample_runs['Count'].to_numpy() - 1)[order]
+    cumulative = np.cumsum(weights)
+    return float(intervals[np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+
+def interval_regimes(runs):
+    """Collapse consecutive sample runs with the same interval into sampling-interval regimes."""
+    sample_runs = runs[runs['State'] != 'Gap'].reset_index(drop=True)
+    if sample_runs.empty:
+        return pd.DataFrame(columns=['Start', 'End', 'Count', 'Interval (min)'])
+
+    interval = sample_runs['Interval (min)']
+    regime_id = (interval.ne(interval.shift()) & interval.notna()).cumsum()
+    regimes = sample_runs.groupby(regime_id).agg(Start=('Start', 'first'), End=('End', 'last'), Count=('Count', 'sum'),
+                                                 **{'Interval (min)': ('Interval (min)', 'first')})
+    return regimes.reset_index(drop=True)
+
+
+def interval_changes(runs):
+    """Points where the sampling interval changes, skipping over gaps."""
+    sample_runs = runs[runs['State'] != 'Gap'].reset_index(drop=True)
+    if len(sample_runs) < 2:
+        return []
+
+    interval = sample_runs['Interval (min)']
+    previous = interval.ffill().shift()
+    changed = interval.notna() & previous.notna() & interval.ne(previous)
+
+    gap_ends = runs.loc[runs['State'] == 'Gap', 'End']
+    after_gap = sample_runs['Start'].isin(gap_ends)
+    previous_end = sample_runs['End'].shift()
+    step = pd.to_timedelta(interval, unit='min')
+
+    change_start = previous_end.where(~after_gap, sample_runs['Start'])
+    change_end = sample_runs['Start'].where(~after_gap, sample_runs['Start'] + step)
+
+    return [
+        {"start": s, "end": e, "interval_minutes": i}
+        for s, e, i in zip(change_start[changed], change_end[changed], interval[changed])
+    ]
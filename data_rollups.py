@@ -0,0 +1,150 @@
+import os
+import yaml
+import pandas as pd
+import logging
+import datetime
+
+from data_alignment import load_series, input_paths, DATE_COL, ALIGNED_COLUMNS
+
+# Load config
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(CONFIG_PATH, 'r') as file:
+    config = yaml.safe_load(file)
+
+project_folder = config['project_folder'].replace("${base_folder}", config['base_folder']).replace("${gage_number}", config['gage_number']).replace("${site_name}", config['site_name'])
+gage_number = config['gage_number']
+
+# Rollups are stored next to the processed data
+rollups_folder = os.path.join(project_folder, config['folders']['processed_data'], 'Rollups')
+rollup_settings = config.get('rollups', {})
+use_rollups = rollup_settings.get('use_rollups', False)
+
+# Resolutions from finest to coarsest, with the shortest span a bin can cover
+RESOLUTIONS = {
+    'Hourly': pd.Timedelta(hours=1),
+    'Daily': pd.Timedelta(days=1),
+    'Monthly': pd.Timedelta(days=28)
+}
+ROLLUP_TYPES = ['Inst_Qw', 'Inst_Hw']
+ROLLUP_COLUMNS = ['Min', 'Max', 'Mean', 'Count', 'Ice Count']
+
+
+def rollup_path(data_type, resolution):
+    return os.path.join(rollups_folder, f"{gage_number}_{data_type}_{resolution}.csv")
+
+
+def bin_start(times, resolution):
+    """Start of the rollup bin each timestamp falls in."""
+    if resolution == 'Hourly':
+        return times.dt.floor('h')
+    if resolution == 'Daily':
+        return times.dt.floor('D')
+    return times.dt.to_period('M').dt.start_time
+
+
+def rollup_raw(series, data_type):
+    """Aggregate a raw inst series into hourly bins."""
+    value_col = ALIGNED_COLUMNS[data_type]
+    frame = pd.DataFrame({
+        DATE_COL: bin_start(series[DATE_COL], 'Hourly'),
+        'Value': series[value_col],
+        'Ice': series[f"{data_type} Ice"].astype(int)
+    })
+    grouped = frame.groupby(DATE_COL)
+    hourly = grouped['Value'].agg(['min', 'max', 'mean', 'count'])
+    hourly.columns = ['Min', 'Max', 'Mean', 'Count']
+    hourly['Ice Count'] = grouped['Ice'].sum()
+    return hourly.reset_index()
+
+
+def rollup_coarser(finer, resolution):
+    """Merge a finer rollup into coarser bins (min of mins, max of maxes, count-weighted mean)."""
+    frame = finer.copy()
+    frame[DATE_COL] = bin_start(frame[DATE_COL], resolution)
+    frame['Sum'] = frame['Mean'].fillna(0) * frame['Count']
+
+    grouped = frame.groupby(DATE_COL)
+    coarser = grouped.agg(Min=('Min', 'min'), Max=('Max', 'max'), Sum=('Sum', 'sum'),
+                          Count=('Count', 'sum'), **{'Ice Count': ('Ice Count', 'sum')})
+    coarser['Mean'] = coarser['Sum'] / coarser['Count'].where(coarser['Count'] > 0)
+    return coarser[ROLLUP_COLUMNS].reset_index()
+
+
+def load_rollup(data_type, resolution):
+    """Load a stored rollup, or an empty frame if it has not been built yet."""
+    path = rollup_path(data_type, resolution)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=[DATE_COL] + ROLLUP_COLUMNS)
+    rollup = pd.read_csv(path)
+    rollup[DATE_COL] = pd.to_datetime(rollup[DATE_COL])
+    return rollup
+
+
+def select_resolution(required_interval):
+    """Coarsest stored resolution whose bins are no wider than the required interval."""
+    required_interval = pd.Timedelta(required_interval)
+    chosen = None
+    for resolution, width in RESOLUTIONS.items():
+        if width <= required_interval:
+            chosen = resolution
+    return chosen
+
+
+def load_coarsest(data_type, required_interval):
+    """Load the coarsest rollup that still resolves the required interval, or None if unavailable."""
+    resolution = select_resolution(required_interval)
+    if resolution is None or not os.path.exists(rollup_path(data_type, resolution)):
+        return None
+    logging.info(f"Using {resolution} rollup for {data_type} (required interval {required_interval})")
+    return load_rollup(data_type, resolution)
+
+
+def update_rollups(data_type, series, rebuild=False):
+    """Build or incrementally extend the hourly, daily and monthly rollups of one series.
+
+    Only bins from the last stored (possibly partial) bin onward are recomputed; pass
+    rebuild=True after a source record has been revised further back.
+    """
+    os.makedirs(rollups_folder, exist_ok=True)
+
+    previous = None
+    for resolution in RESOLUTIONS:
+        existing = pd.DataFrame(columns=[DATE_COL] + ROLLUP_COLUMNS) if rebuild else load_rollup(data_type, resolution)
+
+        if existing.empty:
+            cutoff = None
+        else:
+            cutoff = existing[DATE_COL].max()
+            existing = existing[existing[DATE_COL] < cutoff]
+
+        if resolution == 'Hourly':
+            source = series if cutoff is None else series[series[DATE_COL] >= cutoff]
+            fresh = rollup_raw(source, data_type)
+        else:
+            source = previous if cutoff is None else previous[previous[DATE_COL] >= cutoff]
+            fresh = rollup_coarser(source, resolution)
+
+        rollup = pd.concat([existing, fresh], ignore_index=True) if not existing.empty else fresh
+        rollup.to_csv(rollup_path(data_type, resolution), index=False)
+        logging.info(f"{data_type} {resolution} rollup: {len(fresh)} bins recomputed, {len(rollup)} total")
+        previous = rollup
+
+
+def run_rollups(rebuild=False):
+    for data_type in ROLLUP_TYPES:
+        file_path = input_paths[data_type]
+        if not os.path.exists(file_path):
+            logging.warning(f"Missing file for {data_type}, skipping rollups.")
+            continue
+        update_rollups(data_type, load_series(file_path, data_type), rebuild=rebuild)
+
+
+if __name__ == "__main__":
+    log_folder = os.path.join(project_folder, config['folders']['logs'])
+    os.makedirs(log_folder, exist_ok=True)
+    log_file = os.path.join(log_folder, f"data_rollups_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+    logging.basicConfig(filename=log_file, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    logging.info("Starting rollup update.")
+    run_rollups()
+    print(f"Rollup update completed. See log for details: {log_file}")
@@ -0,0 +1,219 @@
+import os
+import yaml
+import numpy as np
+import pandas as pd
+import logging
+import datetime
+
+from data_alignment import load_series, align_series, input_paths, DATE_COL, ALIGNED_COLUMNS
+from data_quality import build_quality_table, DEFAULT_GAP_THRESHOLD
+
+# Load config
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(CONFIG_PATH, 'r') as file:
+    config = yaml.safe_load(file)
+
+project_folder = config['project_folder'].replace("${base_folder}", config['base_folder']).replace("${gage_number}", config['gage_number']).replace("${site_name}", config['site_name'])
+gage_number = config['gage_number']
+winter_start = config['winter_season']['start']
+winter_end = config['winter_season']['end']
+
+# Detection settings
+detection_settings = config.get('ice_detection', {})
+open_water_months = detection_settings.get('open_water_months', [5, 6, 7, 8, 9, 10])
+min_open_water_points = detection_settings.get('min_open_water_points', 200)
+backwater_threshold_ft = detection_settings.get('backwater_threshold_ft', 0.5)
+rmse_factor = detection_settings.get('rmse_factor', 3)
+min_duration = pd.Timedelta(hours=detection_settings.get('min_duration_hours', 24))
+
+# Output folder
+ice_detection_folder = os.path.join(project_folder, config['folders']['processed_data'], 'IceDetection')
+
+Q_COL = ALIGNED_COLUMNS['Inst_Qw']
+H_COL = ALIGNED_COLUMNS['Inst_Hw']
+
+
+def season_keys(dates):
+    """Season each timestamp belongs to, keyed on the year the Jul-Jun season starts (so each winter is whole)."""
+    years = dates.dt.year.to_numpy()
+    return np.where(dates.dt.month.to_numpy() >= 7, years, years - 1)
+
+
+def design_sums(season_index, n_seasons, x, y):
+    """Per-season normal-equation sums for a quadratic fit of y on x, accumulated with bincount."""
+    powers = [np.bincount(season_index, weights=x ** k, minlength=n_seasons) for k in range(5)]
+    xty = [np.bincount(season_index, weights=y * x ** k, minlength=n_seasons) for k in range(3)]
+    yy = np.bincount(season_index, weights=y * y, minlength=n_seasons)
+
+    xtx = np.empty((n_seasons, 3, 3))
+    for i in range(3):
+        for j in range(3):
+            xtx[:, i, j] = powers[i + j]
+    return xtx, np.stack(xty, axis=1), yy
+
+
+def fit_open_water_ratings(dates, discharge, stage, ice):
+    """Fit stage = a + b ln(Q) + c ln(Q)^2 to open-water pairs for every season in one batched solve.
+
+    Open-water pairs from a calendar year feed both the season ending and the season starting in
+    that year, so each winter is bracketed by the summers on either side. Seasons with too few
+    pairs fall back to the fit over the whole record; if the whole record is also too sparse,
+    those seasons get no rating (NaN coefficients) and are left unflagged.
+    """
+    keys = season_keys(dates)
+    seasons = np.arange(keys.min(), keys.max() + 1)
+    n_seasons = len(seasons)
+
+    open_water = (np.isin(dates.dt.month.to_numpy(), open_water_months) & ~ice
+                  & (discharge > 0) & np.isfinite(stage))
+    years = dates.dt.year.to_numpy()[open_water]
+    x = np.log(discharge[open_water])
+    y = stage[open_water]
+
+    # Summer of calendar year Y belongs to seasons Y-1 (after its winter) and Y (before its winter)
+    index = np.concatenate([years - 1, years]) - seasons[0]
+    in_range = (index >= 0) & (index < n_seasons)
+    x2, y2 = np.concatenate([x, x])[in_range], np.concatenate([y, y])[in_range]
+    xtx, xty, yy = design_sums(index[in_range], n_seasons, x2, y2)
+    counts = xtx[:, 0, 0]
+
+    pooled_xtx, pooled_xty, pooled_yy = design_sums(np.zeros(len(x), dtype=int), 1, x, y)
+    sparse = counts < min_open_water_points
+    xtx[sparse], xty[sparse], yy[sparse] = pooled_xtx[0], pooled_xty[0], pooled_yy[0]
+    counts = np.where(sparse, len(x), counts)
+
+    coefficients = np.einsum('sij,sj->si', np.linalg.pinv(xtx), xty)
+    sse = yy - 2 * np.einsum('si,si->s', coefficients, xty) + np.einsum('si,sij,sj->s', coefficients, xtx, coefficients)
+    rmse = np.sqrt(np.maximum(sse, 0) / np.maximum(counts, 1))
+
+    unfitted = sparse & (len(x) < min_open_water_points)
+    if unfitted.any():
+        logging.warning(f"Only {len(x)} open-water pairs in the whole record (need {min_open_water_points}); "
+                        f"{int(unfitted.sum())} seasons get no rating and are left unflagged.")
+        coefficients[unfitted] = np.nan
+        rmse[unfitted] = np.nan
+
+    return pd.DataFrame({
+        'Season': seasons,
+        'a': coefficients[:, 0],
+        'b': coefficients[:, 1],
+        'c': coefficients[:, 2],
+        'RMSE (ft)': rmse,
+        'Open-Water Points': counts.astype(int),
+        'Pooled Fit': sparse
+    })
+
+
+def flag_backwater(aligned, ratings):
+    """Predicted open-water stage, backwater and ice-affected flags for every aligned stage sample."""
+    frame = aligned[aligned[H_COL].notna()].reset_index(drop=True)
+    dates = frame[DATE_COL]
+    discharge = frame[Q_COL].to_numpy(dtype=float)
+    stage = frame[H_COL].to_numpy(dtype=float)
+    ice = frame['Inst_Qw Ice'].to_numpy(dtype=bool) if 'Inst_Qw Ice' in frame.columns else np.zeros(len(frame), dtype=bool)
+
+    season_index = season_keys(dates) - ratings['Season'].iloc[0]
+    a, b, c = (ratings[col].to_numpy()[season_index] for col in ('a', 'b', 'c'))
+    threshold = np.maximum(backwater_threshold_ft, rmse_factor * ratings['RMSE (ft)'].to_numpy()[season_index])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.log(np.where(discharge > 0, discharge, np.nan))
+    predicted = a + b * x + c * x ** 2
+    backwater = stage - predicted
+
+    frame['Predicted Open-Water Stage (ft)'] = predicted
+    frame['Backwater (ft)'] = backwater
+    frame['Backwater'] = np.nan_to_num(backwater, nan=-np.inf) > threshold
+    frame['Ice Affected'] = frame['Backwater'].to_numpy() | ice
+    return frame
+
+
+def ice_periods(flags):
+    """Runs of ice-affected samples lasting at least min_duration; a gap in the record ends a run."""
+    affected = flags['Ice Affected'].to_numpy()
+    times = flags[DATE_COL].to_numpy()
+    if not affected.any():
+        return pd.DataFrame(columns=['Season', 'Start', 'End', 'Max Backwater (ft)'])
+
+    # Affected samples are the 'Ice' runs of the quality table; runs split only by an interval change are rejoined
+    runs = build_quality_table(times, np.zeros(len(times)), ice=affected, gap_threshold=DEFAULT_GAP_THRESHOLD)
+    period_id = (runs['State'] != 'Ice').cumsum()
+    ice_runs = runs[runs['State'] == 'Ice']
+    periods = ice_runs.groupby(period_id[ice_runs.index]).agg(Start=('Start', 'first'), End=('End', 'last'))
+
+    first = np.searchsorted(times, periods['Start'].to_numpy())
+    after = np.searchsorted(times, periods['End'].to_numpy(), side='right')
+    backwater = np.nan_to_num(flags['Backwater (ft)'].to_numpy(dtype=float), nan=-np.inf)
+    runs = pd.DataFrame({
+        'Season': season_keys(periods['Start']),
+        'Start': periods['Start'].to_numpy(),
+        'End': periods['End'].to_numpy(),
+        # Reduce over [first, after) pairs so each period only sees its own samples
+        'Max Backwater (ft)': np.maximum.reduceat(np.r_[backwater, -np.inf], np.column_stack([first, after]).ravel())[::2]
+    })
+    runs['Max Backwater (ft)'] = runs['Max Backwater (ft)'].replace(-np.inf, np.nan)
+    return runs[(runs['End'] - runs['Start']) >= min_duration].reset_index(drop=True)
+
+
+def summarize_winters(periods, ratings):
+    """Ice onset, ice out and ice-affected duration per winter, counting only the configured winter window."""
+    window_start = pd.to_datetime(periods['Season'].astype(str) + f"-{winter_start}")
+    window_end = pd.to_datetime((periods['Season'] + 1).astype(str) + f"-{winter_end}") + pd.Timedelta(days=1)
+
+    # Summer backwater (weeds, debris) is not ice; periods are clipped to the winter they overlap
+    periods = periods.assign(Start=periods['Start'].clip(lower=window_start), End=periods['End'].clip(upper=window_end))
+    periods = periods[periods['Start'] < periods['End']]
+    periods = periods.assign(Days=(periods['End'] - periods['Start']) / pd.Timedelta(days=1))
+    grouped = periods.groupby('Season')
+    summary = pd.DataFrame({
+        'Ice Onset': grouped['Start'].min(),
+        'Ice Out': grouped['End'].max(),
+        'Ice-Affected Periods': grouped.size(),
+        'Ice-Affected Days': grouped['Days'].sum().round(2),
+        'Max Backwater (ft)': grouped['Max Backwater (ft)'].max().round(2)
+    })
+    summary = ratings.set_index('Season').join(summary, how='left')
+    summary.index = [f"{s}-{s + 1}" for s in summary.index]
+    summary.index.name = 'Winter'
+    return summary
+
+
+def run_ice_detection():
+    if not all(os.path.exists(input_paths[t]) for t in ('Inst_Qw', 'Inst_Hw')):
+        logging.warning("Inst_Qw and Inst_Hw are both required for ice detection, skipping.")
+        return
+
+    inst_qw = load_series(input_paths['Inst_Qw'], 'Inst_Qw')
+    inst_hw = load_series(input_paths['Inst_Hw'], 'Inst_Hw')
+    aligned = align_series(inst_qw, inst_hw, None)
+    aligned = aligned[aligned[H_COL].notna()].reset_index(drop=True)
+    if aligned.empty:
+        logging.warning("No stage samples to screen for ice.")
+        return
+
+    ratings = fit_open_water_ratings(aligned[DATE_COL], aligned[Q_COL].to_numpy(dtype=float),
+                                     aligned[H_COL].to_numpy(dtype=float), aligned['Inst_Qw Ice'].to_numpy(dtype=bool))
+    flags = flag_backwater(aligned, ratings)
+    periods = ice_periods(flags)
+    summary = summarize_winters(periods, ratings)
+
+    os.makedirs(ice_detection_folder, exist_ok=True)
+    flags_path = os.path.join(ice_detection_folder, f"{gage_number}_IceFlags.csv")
+    periods_path = os.path.join(ice_detection_folder, f"{gage_number}_IcePeriods.csv")
+    summary_path = os.path.join(ice_detection_folder, f"{gage_number}_IceSummary.csv")
+    flags.to_csv(flags_path, index=False)
+    periods.to_csv(periods_path, index=False)
+    summary.to_csv(summary_path)
+    logging.info(f"Flagged {int(flags['Ice Affected'].sum())} ice-affected samples in {len(periods)} periods; "
+                 f"summary saved to {summary_path}")
+
+
+if __name__ == "__main__":
+    log_folder = os.path.join(project_folder, config['folders']['logs'])
+    os.makedirs(log_folder, exist_ok=True)
+    log_file = os.path.join(log_folder, f"ice_detection_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+    logging.basicConfig(filename=log_file, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    logging.info("Starting ice detection.")
+    run_ice_detection()
+    print(f"Ice detection completed. See log for details: {log_file}")
@@ -0,0 +1,105 @@
+import os
+import yaml
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import logging
+
+# Load config
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(CONFIG_PATH, 'r') as file:
+    config = yaml.safe_load(file)
+
+plot_settings = config['plot_settings']
+decimation_settings = plot_settings.get('decimation', {})
+decimation_enabled = decimation_settings.get('enabled', True)
+check_fidelity = decimation_settings.get('check_fidelity', False)
+
+
+def pixel_width(ax, dpi=None):
+    """Width of an axes in output pixels at the save dpi."""
+    dpi = plot_settings['dpi'] if dpi is None else dpi
+    fig = ax.get_figure()
+    return max(int(ax.get_position().width * fig.get_figwidth() * dpi), 1)
+
+
+# Series shorter than this many points per pixel column are plotted as they are
+MIN_POINTS_PER_PIXEL = 2
+
+
+def minmax_indices(times, values, n_pixels):
+    """Indices that keep the min and max sample of every pixel column.
+
+    NaN samples mark gaps and ice periods; the first NaN of each NaN run and the valid
+    samples on either side of it are always kept so line breaks survive decimation.
+    """
+    n = len(values)
+    if n <= MIN_POINTS_PER_PIXEL * n_pixels:
+        return np.arange(n)
+
+    t0, t1 = times[0], times[-1]
+    span = max(t1 - t0, 1)
+    bucket = np.minimum(((times - t0) * n_pixels) // span, n_pixels - 1).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+
+    # NaN sorts last, so the first entry per bucket is the min (or max for -values)
+    by_min = np.lexsort((values, bucket))
+    by_max = np.lexsort((-values, bucket))
+
+    is_nan = np.isnan(values)
+    run_start = np.flatnonzero(is_nan & ~np.r_[False, is_nan[:-1]])
+    run_end = np.flatnonzero(is_nan & ~np.r_[is_nan[1:], False])
+
+    keep = np.concatenate([
+        [0, n - 1], by_min[starts], by_max[starts],
+        run_start, np.clip(run_start - 1, 0, n - 1), np.clip(run_end + 1, 0, n - 1)
+    ])
+    return np.unique(keep)
+
+
+def decimate_frame(df, time_col, value_col, n_pixels):
+    """Reduce a time series frame to roughly n_pixels min/max pairs."""
+    if not decimation_enabled or df.empty or len(df) <= MIN_POINTS_PER_PIXEL * n_pixels:
+        return df
+
+    times = df[time_col].to_numpy().astype('datetime64[ns]').astype('int64')
+    values = pd.to_numeric(df[value_col], errors='coerce').to_numpy(dtype=float)
+    keep = minmax_indices(times, values, n_pixels)
+    logging.info(f"Decimated {value_col} from {len(df)} to {len(keep)} points for {n_pixels} px")
+    return df.iloc[keep]
+
+
+def render_fidelity(full_df, decimated_df, time_col, value_col, width_px=1200, height_px=400, log_scale=False):
+    """Fraction of pixels that differ between full-resolution and decimated renders."""
+    images = []
+    for df in (full_df, decimated_df):
+        fig = plt.figure(figsize=(width_px / 100, height_px / 100), dpi=100)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.plot(df[time_col], pd.to_numeric(df[value_col], errors='coerce'), 'k-', linewidth=1, antialiased=False)
+        ax.set_xlim(full_df[time_col].min(), full_df[time_col].max())
+        if log_scale:
+            ax.set_yscale('log')
+        ax.set_ylim(*ax.get_ylim())
+        ax.axis('off')
+        fig.canvas.draw()
+        images.append(np.asarray(fig.canvas.buffer_rgba())[..., :3].copy())
+        plt.close(fig)
+
+    return float(np.mean(np.any(images[0] != images[1], axis=-1)))
+
+
+def plot_series(ax, df, time_col, value_col, dpi=None, log_scale=False, **kwargs):
+    """Plot a time series on ax after decimating it to the axes pixel width."""
+    if df.empty:
+        return None
+
+    n_pixels = pixel_width(ax, dpi)
+    decimated = decimate_frame(df, time_col, value_col, n_pixels)
+
+    if check_fidelity and len(decimated) < len(df):
+        fig = ax.get_figure()
+        height_px = int(ax.get_position().height * fig.get_figheight() * (plot_settings['dpi'] if dpi is None else dpi))
+        mismatch = render_fidelity(df, decimated, time_col, value_col, n_pixels, height_px, log_scale=log_scale)
+        logging.info(f"Decimation fidelity for {value_col}: {mismatch:.4%} of pixels differ")
+
+    return ax.plot(decimated[time_col], pd.to_numeric(decimated[value_col], errors='coerce'), **kwargs)
@@ -38,8 +38,12 @@ def plot_daily_stats(stats, title, ylabel, output_path, log_scale=False):
     plt.ylabel(ylabel, fontsize=12)
     plt.legend()
 
-    plt.xticks(ticks=[0, 90, 181, 273, 364], labels=["Jan-01", "Apr-01", "Jul-01", "Oct-01", "Dec-31"])
-    plt.xlim(left=0, right=364)
+    # Tick positions come from the index so 365- and 366-row (Feb-29) climatologies both line up
+    tick_labels = {"01-01": "Jan-01", "04-01": "Apr-01", "07-01": "Jul-01", "10-01": "Oct-01", "12-31": "Dec-31"}
+    index = list(stats.index)
+    plt.xticks(ticks=[index.index(day) for day in tick_labels if day in index],
+               labels=[label for day, label in tick_labels.items() if day in index])
+    plt.xlim(left=0, right=len(stats) - 1)
 
     if log_scale:
         plt.yscale('log')
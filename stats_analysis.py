@@ -1,9 +1,14 @@
 import os
 import yaml
+import numpy as np
 import pandas as pd
 import logging
 import datetime
 
+from data_rollups import load_coarsest, use_rollups
+from chunked_processing import (chunk_rows_for_budget, iter_csv_chunks, new_accumulator, update_accumulator,
+                                finalize_stats)
+
 # Load config
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
 with open(CONFIG_PATH, 'r') as file:
@@ -25,6 +30,16 @@ daily_qw_path = os.path.join(project_folder, config['folders']['daily_qw'], f"{g
 inst_qw_path = os.path.join(project_folder, config['folders']['inst_qw'], f"{gage_number}_Inst_Qw.csv")
 inst_hw_path = os.path.join(project_folder, config['folders']['inst_hw'], f"{gage_number}_Inst_Hw.csv")
 
+# Out-of-core settings
+out_of_core = config.get('out_of_core', {})
+chunk_rows = chunk_rows_for_budget(out_of_core.get('memory_budget_mb', 256))
+relative_accuracy = out_of_core.get('sketch_relative_accuracy', 0.005)
+
+# Climatology settings
+stats_settings = config.get('stats', {})
+climatology_mode = stats_settings.get('climatology_mode', 'calendar')
+window_days = stats_settings.get('window_days', 7)
+
 def load_data(file_path):
     with open(file_path, 'r') as file:
         header_index = 0
@@ -63,6 +78,55 @@ def calculate_daily_stats(df, date_col, value_col):
     grouped.columns = ['Min', 'Max', 'Mean', 'Median', 'P5', 'P25', 'P75', 'P95']
     return grouped.round(0)
 
+def calendar_position(dates):
+    """Day of year on a 365-day calendar; Feb-29 sits halfway between Feb-28 (59) and Mar-01 (60)."""
+    doy = dates.dt.dayofyear.to_numpy().astype(float)
+    leap = dates.dt.is_leap_year.to_numpy()
+    position = doy - (leap & (doy > 60))
+    position[leap & (doy == 60)] = 59.5
+    return position
+
+def calculate_doy_climatology(df, date_col, value_col, window_days=window_days):
+    """Daily stats pooled over a +/- window_days moving window, from one sorted (day of year, value) array."""
+    valid = df[value_col].notna() & df[date_col].notna()
+    position = calendar_position(df.loc[valid, date_col])
+    values = df.loc[valid, value_col].to_numpy(dtype=float)
+
+    order = np.argsort(position, kind='stable')
+    position, values = position[order], values[order]
+
+    # Wrap the year ends so windows around Jan/Dec see the other end of the calendar
+    head = position < window_days + 1
+    tail = position > 365 - window_days - 1
+    position = np.concatenate([position[tail] - 365, position, position[head] + 365])
+    values = np.concatenate([values[tail], values, values[head]])
+
+    days = pd.date_range('2000-01-01', '2000-12-31', freq='D')
+    centers = calendar_position(days.to_series())
+    half_width = np.where(centers % 1 == 0, window_days, window_days + 0.5)
+    lo = np.searchsorted(position, centers - half_width, side='left')
+    hi = np.searchsorted(position, centers + half_width, side='right')
+
+    quantiles = np.full((len(days), 7), np.nan)
+    for i in np.flatnonzero(hi > lo):
+        quantiles[i] = np.percentile(values[lo[i]:hi[i]], [0, 100, 50, 5, 25, 75, 95])
+
+    cumulative = np.r_[0, np.cumsum(values)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (cumulative[hi] - cumulative[lo]) / (hi - lo)
+
+    stats = pd.DataFrame({
+        'Min': quantiles[:, 0],
+        'Max': quantiles[:, 1],
+        'Mean': mean,
+        'Median': quantiles[:, 2],
+        'P5': quantiles[:, 3],
+        'P25': quantiles[:, 4],
+        'P75': quantiles[:, 5],
+        'P95': quantiles[:, 6]
+    }, index=pd.Index(days.strftime('%m-%d'), name='DayOfYear'))
+    return stats.round(0)
+
 def calculate_monthly_stats(df, date_col, value_col):
     df['Month'] = df[date_col].dt.strftime("%Y-%m")
     grouped = df.groupby('Month')[value_col].agg([
@@ -88,12 +152,100 @@ def calculate_monthly_summary_stats(df, date_col, value_col):
     grouped.index = grouped.index.map(lambda x: datetime.datetime.strptime(x, '%m').strftime('%B'))
     return grouped.round(0)
 
-def process_and_save_stats(file_path, daily_output_name, monthly_output_name, monthly_summary_output_name):
+def calculate_rollup_stats(rollup, key_format):
+    """Stats from an hourly rollup: exact Min/Max/Mean, percentiles over the hourly means."""
+    rollup = rollup.copy()
+    rollup['Key'] = rollup['Date & Time'].dt.strftime(key_format)
+    rollup['Sum'] = rollup['Mean'].fillna(0) * rollup['Count']
+    grouped = rollup.groupby('Key')
+
+    stats = pd.DataFrame({
+        'Min': grouped['Min'].min(),
+        'Max': grouped['Max'].max(),
+        'Mean': grouped['Sum'].sum() / grouped['Count'].sum().where(lambda c: c > 0),
+        'Median': grouped['Mean'].median()
+    })
+    for p in [5, 25, 75, 95]:
+        stats[f'P{p}'] = grouped['Mean'].quantile(p / 100)
+    return stats.round(0)
+
+def process_and_save_rollup_stats(rollup, daily_output_name, monthly_output_name, monthly_summary_output_name):
+    if climatology_mode == 'moving_window':
+        logging.warning("Moving-window climatology is not available from rollups; using calendar-day groups.")
+    daily_stats = calculate_rollup_stats(rollup, "%m-%d")
+    daily_stats.index.name = 'DayOfYear'
+    daily_stats.to_csv(os.path.join(stats_folder, daily_output_name))
+
+    monthly_stats = calculate_rollup_stats(rollup, "%Y-%m")
+    monthly_stats.index.name = 'Month'
+    monthly_stats.to_csv(os.path.join(stats_folder, monthly_output_name))
+
+    monthly_summary_stats = calculate_rollup_stats(rollup, "%m")
+    monthly_summary_stats.index = monthly_summary_stats.index.map(lambda x: datetime.datetime.strptime(x, '%m').strftime('%B'))
+    monthly_summary_stats.index.name = 'Month'
+    monthly_summary_stats.to_csv(os.path.join(stats_folder, monthly_summary_output_name))
+
+    logging.info(f"Saved rollup-based stats to: {daily_output_name}, {monthly_output_name}, {monthly_summary_output_name}")
+
+def calculate_stats_chunked(file_path):
+    """Daily, monthly and monthly summary stats in one streamed pass with mergeable accumulators."""
+    key_formats = {'daily': "%m-%d", 'monthly': "%Y-%m", 'summary': "%m"}
+    accumulators = {name: new_accumulator() for name in key_formats}
+
+    date_col = None
+    value_col = None
+    for chunk in iter_csv_chunks(file_path, chunk_rows):
+        if date_col is None:
+            date_col = next((col for col in chunk.columns if "Date" in col), None)
+            value_col = next((col for col in chunk.columns if "Discharge" in col or "Gage Height" in col), None)
+            if date_col is None or value_col is None:
+                raise ValueError(f"Could not detect Date/Value columns in {file_path}")
+
+        dates = pd.to_datetime(chunk[date_col])
+        values = pd.to_numeric(chunk[value_col], errors='coerce')
+        for name, key_format in key_formats.items():
+            accumulators[name] = update_accumulator(accumulators[name], dates.dt.strftime(key_format), values,
+                                                    relative_accuracy)
+
+    daily_stats = finalize_stats(accumulators['daily'], relative_accuracy).round(0)
+    daily_stats.index.name = 'DayOfYear'
+    monthly_stats = finalize_stats(accumulators['monthly'], relative_accuracy).round(0)
+    monthly_stats.index.name = 'Month'
+    monthly_summary_stats = finalize_stats(accumulators['summary'], relative_accuracy).round(0)
+    monthly_summary_stats.index = monthly_summary_stats.index.map(lambda x: datetime.datetime.strptime(x, '%m').strftime('%B'))
+    monthly_summary_stats.index.name = 'Month'
+    return daily_stats, monthly_stats, monthly_summary_stats
+
+def process_and_save_stats_chunked(file_path, daily_output_name, monthly_output_name, monthly_summary_output_name):
+    if climatology_mode == 'moving_window':
+        logging.warning("Moving-window climatology is not available out of core; using calendar-day groups.")
+    daily_stats, monthly_stats, monthly_summary_stats = calculate_stats_chunked(file_path)
+
+    daily_stats.to_csv(os.path.join(stats_folder, daily_output_name))
+    monthly_stats.to_csv(os.path.join(stats_folder, monthly_output_name))
+    monthly_summary_stats.to_csv(os.path.join(stats_folder, monthly_summary_output_name))
+    logging.info(f"Saved out-of-core stats for {file_path} ({chunk_rows} rows per chunk)")
+
+def process_and_save_stats(file_path, daily_output_name, monthly_output_name, monthly_summary_output_name, rollup_type=None):
     try:
+        # Inst records can be answered from the hourly rollup instead of every raw sample
+        if use_rollups and rollup_type is not None:
+            rollup = load_coarsest(rollup_type, pd.Timedelta(hours=1))
+            if rollup is not None:
+                process_and_save_rollup_stats(rollup, daily_output_name, monthly_output_name, monthly_summary_output_name)
+                return
+
+        if out_of_core.get('enabled', False):
+            process_and_save_stats_chunked(file_path, daily_output_name, monthly_output_name, monthly_summary_output_name)
+            return
+
         df, date_col, value_col = load_data(file_path)
 
         # Daily stats
-        daily_stats = calculate_daily_stats(df, date_col, value_col)
+        if climatology_mode == 'moving_window':
+            daily_stats = calculate_doy_climatology(df, date_col, value_col)
+        else:
+            daily_stats = calculate_daily_stats(df, date_col, value_col)
         daily_stats_path = os.path.join(stats_folder, daily_output_name)
         daily_stats.to_csv(daily_stats_path)
         logging.info(f"Saved daily climatology stats to: {daily_stats_path}")
@@ -126,13 +278,15 @@ def main():
         inst_qw_path,
         "DailyStats_Inst_Qw.csv",
         "MonthlyStats_Inst_Qw.csv",
-        "MonthlySummaryStats_Inst_Qw.csv"
+        "MonthlySummaryStats_Inst_Qw.csv",
+        rollup_type="Inst_Qw"
     )
     process_and_save_stats(
         inst_hw_path,
         "DailyStats_Inst_Hw.csv",
         "MonthlyStats_Inst_Hw.csv",
-        "MonthlySummaryStats_Inst_Hw.csv"
+        "MonthlySummaryStats_Inst_Hw.csv",
+        rollup_type="Inst_Hw"
     )
 
     logging.info("Statistical analysis completed.")
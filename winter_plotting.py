@@ -5,6 +5,10 @@ import matplotlib.pyplot as plt
 import numpy as np
 import logging
 
+from data_rollups import load_coarsest, use_rollups
+from plot_decimation import plot_series
+from data_quality import build_quality_table, break_times
+
 # Load config
 CONFIG_PATH = r"C:\Users\WeisA\Documents\Oil_Creek\USGS\03020500_OilCreek\03020500_IceBreakup_Toolkit\config.yaml"
 
@@ -44,26 +48,28 @@ def align_daily_to_noon(daily_data):
 def insert_gaps(df, time_col, value_col, threshold=pd.Timedelta('1 day')):
     df = df.copy()
     df[value_col] = pd.to_numeric(df[value_col], errors='coerce')
-    df['Time_Diff'] = df[time_col].diff()
-
-    gap_indices = df[df['Time_Diff'] > threshold].index
-    ice_indices = df[df[value_col].isna()].index
-    all_gaps = sorted(set(gap_indices).union(set(ice_indices)))
+    df = df.dropna(subset=[time_col]).sort_values(time_col, kind='mergesort')
 
-    for idx in all_gaps:
-        gap_row = pd.DataFrame({time_col: [df.loc[idx, time_col] - pd.Timedelta(seconds=1)],
-                                value_col: [np.nan]})
-        df = pd.concat([df.loc[:idx - 1], gap_row, df.loc[idx:]])
+    # NaN rows just before each gap and ice/missing run so plotted lines break there
+    runs = build_quality_table(df[time_col].to_numpy(), df[value_col].to_numpy(dtype=float), gap_threshold=threshold)
+    breaks = pd.to_datetime(break_times(runs)) - pd.Timedelta(seconds=1)
+    gap_rows = pd.DataFrame({time_col: breaks, value_col: np.nan})
 
-    return df.drop(columns=['Time_Diff'])
+    return pd.concat([df, gap_rows]).sort_values(time_col, kind='mergesort').reset_index(drop=True)
 
 def create_expanded_winter_stats(stats_data):
+    # Stats label days as '%d-%b' (Date) or '%m-%d' (DayOfYear); Feb-29 rows only land in leap years
+    if 'DayOfYear' in stats_data.columns:
+        month_day = stats_data['DayOfYear']
+    else:
+        month_day = pd.to_datetime('2000-' + stats_data['Date'], format='%Y-%d-%b').dt.strftime('%m-%d')
+
     expanded_stats = []
     for year in range(1932, 2026):
         temp = stats_data.copy()
         temp['Year'] = year
-        temp['Date'] = pd.to_datetime(temp['Date'], format='%d-%b') + pd.DateOffset(year=year)
-        expanded_stats.append(temp)
+        temp['Date'] = pd.to_datetime(f"{year}-" + month_day, format='%Y-%m-%d', errors='coerce')
+        expanded_stats.append(temp.dropna(subset=['Date']))
 
     expanded_stats = pd.concat(expanded_stats, ignore_index=True)
     expanded_stats['Date'] = expanded_stats['Date'] + pd.Timedelta(hours=12)
@@ -85,6 +91,9 @@ def process_and_plot_all():
     expanded_daily_stats = create_expanded_winter_stats(daily_stats)
     expanded_inst_stats = create_expanded_winter_stats(inst_stats)
 
+    # Hourly rollup covers whole seasons with a few thousand rows instead of the raw 15-minute splits
+    inst_qw_rollup = load_coarsest('Inst_Qw', pd.Timedelta(hours=1)) if use_rollups else None
+
     for winter in sorted(all_winters):
         logging.info(f"Processing winter: {winter}")
 
@@ -100,7 +109,14 @@ def process_and_plot_all():
             daily_data['Discharge (cfs)'] = pd.to_numeric(daily_data['Discharge (cfs)'], errors='coerce')
             daily_data = align_daily_to_noon(daily_data)
 
-        if os.path.exists(inst_qw_file):
+        if inst_qw_rollup is not None:
+            year1, year2 = map(int, winter.split('-'))
+            season = inst_qw_rollup[(inst_qw_rollup['Date & Time'] >= pd.Timestamp(f"{year1}-11-01")) &
+                                    (inst_qw_rollup['Date & Time'] < pd.Timestamp(f"{year2}-04-01"))]
+            # Hourly Min/Max keep the instantaneous peaks that an hourly mean would flatten
+            inst_qw_data = season[['Date & Time', 'Min', 'Max']].reset_index(drop=True)
+            inst_qw_data = insert_gaps(inst_qw_data, 'Date & Time', 'Max')
+        elif os.path.exists(inst_qw_file):
             inst_qw_data = pd.read_csv(inst_qw_file)
             inst_qw_data['Date & Time'] = pd.to_datetime(inst_qw_data['Date & Time'], errors='coerce')
             inst_qw_data['Discharge (cfs)'] = pd.to_numeric(inst_qw_data['Discharge (cfs)'], errors='coerce')
@@ -127,6 +143,20 @@ def plot_log_discharge_winter(winter, daily_data, inst_qw_data, expanded_daily_s
     plt.fill_between(winter_stats['Date'], winter_stats['P5'], winter_stats['P95'], color='blue', alpha=0.2)
     plt.plot(winter_stats['Date'], winter_stats['Mean'], 'k-', label='Mean')
 
+    colors = config['plot_settings']['colors']
+    linestyles = config['plot_settings']['linestyle']
+    ax = plt.gca()
+    plot_series(ax, daily_data, 'Date', 'Discharge (cfs)', log_scale=True,
+                color=colors['daily'], linestyle=linestyles['daily'], label='Daily Discharge')
+    if 'Max' in inst_qw_data.columns:
+        plt.fill_between(inst_qw_data['Date & Time'], inst_qw_data['Min'], inst_qw_data['Max'], color=colors['inst'],
+                         alpha=0.4, linewidth=0, label='Hourly Discharge Range')
+        plot_series(ax, inst_qw_data, 'Date & Time', 'Max', log_scale=True,
+                    color=colors['inst'], linestyle=linestyles['inst'], linewidth=0.8, label='Hourly Maximum Discharge')
+    else:
+        plot_series(ax, inst_qw_data, 'Date & Time', 'Discharge (cfs)', log_scale=True,
+                    color=colors['inst'], linestyle=linestyles['inst'], linewidth=0.8, label='Instantaneous Discharge')
+
     plt.yscale('log')
     plt.ylim(10, 100000)
     plt.ylabel('Discharge (ft³/s)')
@@ -1,9 +1,18 @@
 import os
 import yaml
+import numpy as np
 import pandas as pd
 import logging
 import datetime
 import json
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from data_quality import build_quality_table, completeness as window_completeness
+from chunked_processing import chunk_rows_for_budget, iter_csv_chunks
 
 # Load config
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
@@ -15,11 +24,7 @@ project_folder = config['project_folder'].replace("${base_folder}", config['base
     "${site_name}", config['site_name'])
 gage_number = config['gage_number']
 
-# Set up logging
-log_folder = os.path.join(project_folder, config['folders']['logs'])
-os.makedirs(log_folder, exist_ok=True)
-log_file = os.path.join(log_folder, f"winter_processing_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
-logging.basicConfig(filename=log_file, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 
 # Expected columns for each data type
 EXPECTED_COLUMNS = {
@@ -40,6 +45,16 @@ metadata_paths = {k: v.replace('.csv', '_metadata.json') for k, v in input_paths
 winter_splits_folder = os.path.join(project_folder, config['folders']['processed_data'], 'Winter_Splits')
 os.makedirs(winter_splits_folder, exist_ok=True)
 
+# Parallel execution settings
+processing_settings = config.get('winter_processing', {})
+run_parallel = processing_settings.get('parallel', False)
+max_workers = processing_settings.get('max_workers')
+seasons_per_task = processing_settings.get('seasons_per_task', 10)
+
+# Out-of-core settings
+out_of_core = config.get('out_of_core', {})
+chunk_rows = chunk_rows_for_budget(out_of_core.get('memory_budget_mb', 256))
+
 
 def load_and_validate_data(file_path, data_type):
     with open(file_path, 'r') as file:
@@ -74,63 +89,286 @@ def generate_full_winter_index(start_year, interval_minutes, daily=False):
         return pd.date_range(nov1, mar31, freq=f'{interval_minutes}min')
 
 
-def process_data_type(data_type):
+@contextmanager
+def atomic_open(output_file, newline=None):
+    """Open a temp file in the same folder for writing and rename it over output_file on success."""
+    tmp_path = f"{output_file}.{uuid.uuid4().hex}.tmp"
+    # Created with 0666 like a plain open(), so the umask decides the final mode
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'w', newline=newline) as f:
+            yield f
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def season_completeness(runs, water_years, interval_minutes, daily):
+    """Completeness of each winter from the run-length table, keyed by water year."""
+    grid_minutes = 1440 if daily else interval_minutes
+    completeness = {}
+    for water_year in water_years:
+        expected_index = generate_full_winter_index(water_year, interval_minutes, daily=daily)
+        completeness[water_year] = window_completeness(runs, expected_index[0], expected_index[-1], grid_minutes)
+    return completeness
+
+
+def prepare_data_type(data_type):
+    """Parse one source file into the sorted arrays, water years and season completeness the season writer needs."""
     file_path = input_paths[data_type]
     metadata_path = metadata_paths[data_type]
 
     if not os.path.exists(file_path):
         logging.warning(f"Missing file for {data_type}, skipping.")
-        return
+        return None
 
     with open(metadata_path, 'r') as meta_file:
         metadata = json.load(meta_file)
         interval_minutes = metadata.get('sampling_interval_minutes', 1440 if 'Daily' in data_type else 15)
 
     df, date_col, value_col = load_and_validate_data(file_path, data_type)
+    df = df.dropna(subset=[date_col]).sort_values(date_col, kind='mergesort')
+
+    times = df[date_col].to_numpy().astype('datetime64[ns]').astype('int64')
+    values = df[value_col].to_numpy(dtype=float)
+
+    # Nov-Mar rows, keyed on the year the winter starts in
+    months = df[date_col].dt.month.to_numpy()
+    winter = (months >= 11) | (months <= 3)
+    water_years = np.where(months >= 11, df[date_col].dt.year.to_numpy(), df[date_col].dt.year.to_numpy() - 1)
+
+    # Completeness comes from the run-length table, not from the reindexed grid
+    daily = 'Daily' in data_type
+    runs = build_quality_table(times, values, gap_threshold=pd.Timedelta(days=1) if daily else pd.Timedelta(minutes=120))
+    water_years = np.unique(water_years[winter]).tolist()
+
+    return {
+        'data_type': data_type,
+        'date_col': date_col,
+        'value_col': value_col,
+        'interval_minutes': interval_minutes,
+        'times': times,
+        'values': values,
+        'water_years': water_years,
+        'completeness': season_completeness(runs, water_years, interval_minutes, daily)
+    }
+
+
+def season_frame(times, values, water_year, interval_minutes, daily, date_col, value_col):
+    """Reindex one winter onto its full expected grid by sorted lookup."""
+    expected_index = generate_full_winter_index(water_year, interval_minutes, daily=daily)
+    grid = expected_index.to_numpy().astype('datetime64[ns]').astype('int64')
+
+    pos = np.searchsorted(times, grid)
+    pos_clipped = np.minimum(pos, len(times) - 1)
+    match = (pos < len(times)) & (times[pos_clipped] == grid)
+
+    # WaterYear stays an integer column unless gap rows were inserted, as reindexing would leave it
+    season_data = pd.DataFrame({
+        date_col: expected_index,
+        value_col: np.where(match, values[pos_clipped], np.nan),
+        'Month-Day': np.where(match, expected_index.strftime('%m-%d'), np.nan),
+        'WaterYear': np.full(len(grid), water_year) if match.all() else np.where(match, water_year, np.nan)
+    })
+    return season_data
+
+
+def write_seasons(task):
+    """Write a range of winter seasons for one data type; runs in-process or in a pool worker.
+
+    times/values are either arrays or paths to .npy files opened memory-mapped, and completeness
+    is precomputed per water year, so pool workers receive no pickled frames.
+    """
+    times = np.load(task['times'], mmap_mode='r') if isinstance(task['times'], str) else task['times']
+    values = np.load(task['values'], mmap_mode='r') if isinstance(task['values'], str) else task['values']
+    data_type = task['data_type']
+    daily = 'Daily' in data_type
+
+    output_folder = os.path.join(winter_splits_folder, *data_type.lower().split('_'))
+    os.makedirs(output_folder, exist_ok=True)
+
+    results = []
+    for water_year in task['water_years']:
+        season_data = season_frame(times, values, water_year, task['interval_minutes'], daily,
+                                   task['date_col'], task['value_col'])
+        completeness = task['completeness'][water_year]
+
+        output_file = os.path.join(output_folder,
+                                   f"{gage_number}_Winter{data_type.replace('_', '')}_{water_year}-{water_year + 1}.csv")
+        with atomic_open(output_file, newline='') as f:
+            season_data.to_csv(f, index=False)
 
-    df['Month-Day'] = df[date_col].dt.strftime('%m-%d')
-    df['WaterYear'] = df[date_col].apply(lambda d: d.year if d.month >= 11 else d.year - 1)
+        results.append((water_year, f"{water_year}-{water_year + 1}: Completeness = {completeness:.2f}%"))
 
-    winter_data = df[(df['Month-Day'] >= '11-01') | (df['Month-Day'] <= '03-31')]
+    return data_type, results
 
-    summary = []
-    for water_year, season_data in winter_data.groupby('WaterYear'):
-        expected_index = generate_full_winter_index(water_year, interval_minutes, daily=('Daily' in data_type))
 
-        if 'Daily' in data_type:
-            season_data = season_data.set_index(date_col).reindex(expected_index)
-        else:
-            season_data = season_data.set_index(date_col).reindex(expected_index)
+def save_winter_summary(data_type, results):
+    """Write the season summary in water-year order regardless of the order seasons finished in."""
+    results = sorted(results)
+    for water_year, line in results:
+        logging.info(f"Saved winter data for {water_year}-{water_year + 1} ({data_type}) - {line.split(': ', 1)[1]}")
 
-        season_data[value_col] = season_data[value_col].astype(float)
+    summary_path = os.path.join(winter_splits_folder, f"{gage_number}_{data_type}_WinterSummary.txt")
+    with atomic_open(summary_path) as f:
+        f.write("\n".join(line for _, line in results))
+    logging.info(f"Winter summary for {data_type} saved to {summary_path}")
 
-        season_data = season_data.reset_index().rename(columns={'index': date_col})
-        completeness = season_data[value_col].notna().mean() * 100
 
-        output_folder = os.path.join(winter_splits_folder, *data_type.lower().split('_'))
-        os.makedirs(output_folder, exist_ok=True)
+def process_data_type(data_type):
+    prepared = prepare_data_type(data_type)
+    if prepared is None:
+        return
 
-        output_file = os.path.join(output_folder,
-                                   f"{gage_number}_Winter{data_type.replace('_', '')}_{water_year}-{water_year + 1}.csv")
-        season_data.to_csv(output_file, index=False)
+    _, results = write_seasons(prepared)
+    save_winter_summary(data_type, results)
 
-        summary.append(f"{water_year}-{water_year + 1}: Completeness = {completeness:.2f}%")
-        logging.info(
-            f"Saved winter data for {water_year}-{water_year + 1} ({data_type}) - Completeness = {completeness:.2f}%")
 
-    summary_path = os.path.join(winter_splits_folder, f"{gage_number}_{data_type}_WinterSummary.txt")
-    with open(summary_path, 'w') as f:
-        f.write("\n".join(summary))
-    logging.info(f"Winter summary for {data_type} saved to {summary_path}")
+def process_data_type_chunked(data_type):
+    """Split one data type while streaming the source in bounded chunks, holding at most one open season."""
+    file_path = input_paths[data_type]
+    metadata_path = metadata_paths[data_type]
+
+    if not os.path.exists(file_path):
+        logging.warning(f"Missing file for {data_type}, skipping.")
+        return
+
+    with open(metadata_path, 'r') as meta_file:
+        metadata = json.load(meta_file)
+        interval_minutes = metadata.get('sampling_interval_minutes', 1440 if 'Daily' in data_type else 15)
+
+    date_col = EXPECTED_COLUMNS[data_type]['date']
+    value_col = EXPECTED_COLUMNS[data_type]['value']
+    gap_threshold = pd.Timedelta(days=1) if 'Daily' in data_type else pd.Timedelta(minutes=120)
+
+    pending = {}
+    results = []
+
+    def flush(water_year):
+        times = np.concatenate([t for t, _ in pending[water_year]])
+        values = np.concatenate([v for _, v in pending[water_year]])
+        del pending[water_year]
+        runs = build_quality_table(times, values, gap_threshold=gap_threshold)
+        _, season_results = write_seasons({
+            'data_type': data_type,
+            'date_col': date_col,
+            'value_col': value_col,
+            'interval_minutes': interval_minutes,
+            'times': times,
+            'values': values,
+            'water_years': [water_year],
+            'completeness': season_completeness(runs, [water_year], interval_minutes, 'Daily' in data_type)
+        })
+        results.extend(season_results)
+
+    for chunk in iter_csv_chunks(file_path, chunk_rows):
+        if not all(col in chunk.columns for col in (date_col, value_col)):
+            raise ValueError(
+                f"Column mismatch in {file_path}. Expected: {[date_col, value_col]}, Found: {chunk.columns.tolist()}")
+
+        dates = pd.to_datetime(chunk[date_col], errors='coerce')
+        dates = dates[dates.notna()]
+        times = dates.to_numpy().astype('datetime64[ns]').astype('int64')
+        values = pd.to_numeric(chunk.loc[dates.index, value_col], errors='coerce').to_numpy(dtype=float)
+        if len(times) == 0:
+            continue
+
+        months = dates.dt.month.to_numpy()
+        water_years = np.where(months >= 11, dates.dt.year.to_numpy(), dates.dt.year.to_numpy() - 1)
+        winter = (months >= 11) | (months <= 3)
+        for water_year in np.unique(water_years[winter]):
+            selected = winter & (water_years == water_year)
+            pending.setdefault(int(water_year), []).append((times[selected], values[selected]))
+
+        # Seasons before the one the chunk ends in (or that one too, once past March) are complete
+        last_water_year = water_years[-1]
+        for water_year in sorted(pending):
+            if water_year < last_water_year or (water_year == last_water_year and not winter[-1]):
+                flush(water_year)
+
+    for water_year in sorted(pending):
+        flush(water_year)
+
+    save_winter_summary(data_type, results)
+
+
+def prepare_shared(data_type, shared_folder):
+    """Parse one data type in a pool worker and leave its arrays in .npy files for the season writers."""
+    logging.info(f"Preparing {data_type}")
+    prepared = prepare_data_type(data_type)
+    if prepared is None:
+        return None
+
+    for key in ('times', 'values'):
+        path = os.path.join(shared_folder, f"{data_type}_{key}.npy")
+        np.save(path, prepared[key])
+        prepared[key] = path
+    return prepared
+
+
+def init_worker_logging(log_file, level):
+    """Send a pool worker's logging to the run's log; spawned workers start unconfigured."""
+    if log_file is not None:
+        logging.basicConfig(filename=log_file, level=level, format=LOG_FORMAT)
+
+
+def process_all_parallel():
+    """Parse each data type and write its season ranges as tasks on one process pool."""
+    shared_folder = tempfile.mkdtemp(prefix='.shared_', dir=winter_splits_folder)
+    root = logging.getLogger()
+    log_file = next((h.baseFilename for h in root.handlers if isinstance(h, logging.FileHandler)), None)
+    try:
+        summaries = {}
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker_logging,
+                                 initargs=(log_file, root.level)) as executor:
+            preparing = [executor.submit(prepare_shared, data_type, shared_folder) for data_type in input_paths.keys()]
+
+            # Season writers for a data type start as soon as its source has been parsed
+            writing = []
+            for future in as_completed(preparing):
+                prepared = future.result()
+                if prepared is None:
+                    continue
+                water_years = prepared['water_years']
+                for i in range(0, len(water_years), seasons_per_task):
+                    writing.append(executor.submit(write_seasons, dict(prepared, water_years=water_years[i:i + seasons_per_task])))
+
+            for future in writing:
+                data_type, results = future.result()
+                summaries.setdefault(data_type, []).extend(results)
+
+        for data_type in input_paths.keys():
+            if data_type in summaries:
+                save_winter_summary(data_type, summaries[data_type])
+    finally:
+        shutil.rmtree(shared_folder, ignore_errors=True)
 
 
 def process_all():
+    if out_of_core.get('enabled', False):
+        for data_type in input_paths.keys():
+            logging.info(f"Processing {data_type} out of core ({chunk_rows} rows per chunk)")
+            process_data_type_chunked(data_type)
+        return
+
+    if run_parallel:
+        logging.info("Processing all data types in parallel")
+        process_all_parallel()
+        return
+
     for data_type in input_paths.keys():
         logging.info(f"Processing {data_type}")
         process_data_type(data_type)
 
 
 if __name__ == "__main__":
+    log_folder = os.path.join(project_folder, config['folders']['logs'])
+    os.makedirs(log_folder, exist_ok=True)
+    log_file = os.path.join(log_folder, f"winter_processing_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+    logging.basicConfig(filename=log_file, level=logging.INFO, format=LOG_FORMAT)
+
     logging.info("Starting winter processing.")
     process_all()
     logging.info("Winter processing completed. See log for details: " + log_file)